@@ -1,38 +1,2244 @@
 """
     Program to increase the count of desired capacity of an asg.
+    boto3, botocore and asyncio are imported on first use, so importing
+    this module and running it against an injected client stays cheap.
 """
+import bisect
+import collections
+import contextlib
+import datetime
+import functools
+import itertools
+import json
 import logging
 import os
-import boto3
-from botocore.exceptions import ClientError
+import random
+import re
+import signal
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# reasons of the capacity decision taken for an ASG
+REASON_INCREASE = 'increase'
+REASON_AT_MAX = 'at_max'
+REASON_NO_POLICY = 'no_scaling_policy'
+
+# default boto3 session, and its shared autoscaling clients by connection pool size
+_DEFAULT_SESSION = None
+_DEFAULT_CLIENTS = {}
+# boto3 sessions are not thread safe, clients are created under the lock
+_DEFAULT_CLIENTS_LOCK = threading.Lock()
+# rate limiter handed to the worker processes of run_targets(), shared by all their clients
+_SHARED_RATE_LIMITER = None
+
+
+def _api_errors() -> tuple:
+    """
+        Returns the botocore errors raised by API calls, importing botocore on first use
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+    return ClientError, BotoCoreError
+
+
+def _parameters_rejected(error: Exception) -> bool:
+    """
+        Returns True if an API error is the service or botocore rejecting the parameters
+        of the call, as opposed to throttling, permission or connection errors
+    """
+    from botocore.exceptions import ClientError, ParamValidationError
+    if isinstance(error, ParamValidationError):
+        return True
+    return isinstance(error, ClientError) and \
+        error.response.get('Error', {}).get('Code') == 'ValidationError'
+
+
+def _server_filter(key: str, value: str, level: int) -> dict:
+    """
+        Returns the describe_auto_scaling_groups arguments of a server side tag filter,
+        level 0 also leaves the instance lists out, level 1 only sends the tag filter
+    """
+    kwargs = {'Filters': [{'Name': 'tag:{}'.format(key), 'Values': [value]}]}
+    if level == 0:
+        # instance lists are not needed by the sweep, the service can leave them out
+        kwargs['IncludeInstances'] = False
+    return kwargs
+
+
+# levels of _server_filter() tried before falling back on the client side filter
+_SERVER_FILTER_LEVELS = 2
+
+
+def _client_config(max_pool_connections: int):
+    """
+        Returns the botocore client config used for every autoscaling client
+    """
+    from botocore.config import Config
+    # Modifying the default retries behaviour {mode: standard->adaptive} (max_attempts: 5->10)
+    # and sizing the connection pool so every worker thread gets its own connection
+    return Config(retries={"max_attempts": 10, "mode": "adaptive"},
+                  max_pool_connections=max_pool_connections)
+
+
+def _default_client(max_pool_connections: int, shared: bool = True):
+    """
+        Returns an autoscaling client of the default boto3 session, the session is
+        created once per process. A shared client is created once per connection pool
+        size and handed to every caller, so no hooks may be registered on it.
+        shared=False creates a client for the caller alone, e.g. for an AsgCount whose
+        metrics and rate limiter hooks must only see its own calls.
+    """
+    global _DEFAULT_SESSION
+    with _DEFAULT_CLIENTS_LOCK:
+        if _DEFAULT_SESSION is None:
+            import boto3
+            _DEFAULT_SESSION = boto3.session.Session()  # initializing the boto3 session
+        if not shared:
+            return _DEFAULT_SESSION.client(
+                "autoscaling", config=_client_config(max_pool_connections))
+        if max_pool_connections not in _DEFAULT_CLIENTS:
+            _DEFAULT_CLIENTS[max_pool_connections] = _DEFAULT_SESSION.client(
+                "autoscaling", config=_client_config(max_pool_connections))
+        return _DEFAULT_CLIENTS[max_pool_connections]
+
+
+def get_shard(shard_index: int = None, shard_count: int = None) -> tuple:
+    """
+        Return the shard of this worker, the arguments default to the
+        ASG_SHARD_INDEX and ASG_SHARD_COUNT container environment variables
+
+        Returns
+        -------
+        tuple containing int (shard_index, shard_count)
+            A single shard (0, 1) when sharding is not configured
+    """
+    if shard_index is None:
+        shard_index = int(os.getenv('ASG_SHARD_INDEX', '0'))
+    if shard_count is None:
+        shard_count = int(os.getenv('ASG_SHARD_COUNT', '1'))
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError('invalid shard {} of {}'.format(shard_index, shard_count))
+    return shard_index, shard_count
+
+
+def in_shard(name: str, shard_index: int, shard_count: int) -> bool:
+    """
+        Returns True if the ASG belongs to the given shard. The shard is a CRC32 of the
+        name, stable across processes and hosts unlike hash(), so workers sharing
+        the same shard_count handle disjoint slices of the fleet
+    """
+    return shard_count <= 1 or zlib.crc32(name.encode('utf-8')) % shard_count == shard_index
+
+
+def target_label(target: tuple) -> str:
+    """
+        Returns a file name safe label of a (region, role_arn) target, its region and
+        the account and name of its role, e.g. us-east-1.123456789012-deployer.
+        'default' stands for the default region and 'self' for the container credentials.
+    """
+    region, role_arn = target
+    role = 'self'
+    if role_arn:
+        # arn:aws:iam::<account>:role/<path>/<name>
+        fields = role_arn.split(':')
+        role = '{}-{}'.format(fields[4], fields[5].rsplit('/', 1)[-1]) \
+            if len(fields) > 5 else role_arn
+    return '.'.join(re.sub(r'[^A-Za-z0-9_-]+', '-', part) for part in (region or 'default', role))
+
+
+def target_path(path: str, target: tuple) -> str:
+    """
+        Returns the file of a target, its label inserted before the extensions of path,
+        e.g. journal.jsonl -> journal.us-east-1.123456789012-deployer.jsonl, so the
+        workers of a multi-target run never share a file. path is returned as is
+        when there is no target.
+    """
+    if not path or target is None:
+        return path
+    directory, name = os.path.split(path)
+    stem, dot, extensions = name.partition('.')
+    return os.path.join(directory, '{}.{}{}{}'.format(stem, target_label(target), dot, extensions))
+
+
+class AsgRecord:
+    """
+        Compact record of one ASG keeping only what a sweep needs out of the
+        describe_auto_scaling_groups document: name, capacities and tags.
+        Instances, launch templates and the rest of the document are dropped as
+        soon as a page is parsed, so memory scales with the number of ASG only.
+    """
+    __slots__ = ('name', 'desired', 'min_size', 'max_size', 'tags')
+
+    def __init__(self, name: str, desired: int, min_size: int, max_size: int,
+                 tags: tuple = ()) -> None:
+        self.name = name
+        self.desired = desired
+        self.min_size = min_size
+        self.max_size = max_size
+        # tuple of (key, value) pairs
+        self.tags = tags
+
+    @classmethod
+    def from_group(cls, group: dict) -> 'AsgRecord':
+        """
+            Projects a describe_auto_scaling_groups document into a record,
+            tag keys are interned as the same few keys repeat on every ASG
+        """
+        return cls(group['AutoScalingGroupName'], int(group['DesiredCapacity']),
+                   int(group.get('MinSize', 0)), int(group['MaxSize']),
+                   tuple((sys.intern(tag['Key']), tag.get('Value', ''))
+                         for tag in group.get('Tags', ())))
+
+    @classmethod
+    def of(cls, asg) -> 'AsgRecord':
+        """
+            Returns asg itself when it is already a record, its projection otherwise
+        """
+        return asg if isinstance(asg, cls) else cls.from_group(asg)
+
+    def tag(self, key: str, default: str = None) -> str:
+        """
+            Returns the value of the given tag key
+        """
+        for tag_key, tag_value in self.tags:
+            if tag_key == key:
+                return tag_value
+        return default
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, AsgRecord) and all(
+            getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self) -> str:
+        return 'AsgRecord(name={!r}, desired={}, min_size={}, max_size={})'.format(
+            self.name, self.desired, self.min_size, self.max_size)
+
+
+# tokens of the tag selector language, quoted strings, operators and bare words
+_SELECTOR_TOKEN = re.compile(r"""\s*(?:("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')"""
+                             r"""|(\^=|[()&|!=])|([^\s()&|!=^'"]+))""")
+_SELECTOR_KEYWORDS = {'and': '&', 'or': '|', 'not': '!'}
+
+
+class TagSelector:
+    """
+        Tag selector compiled once into a Python predicate and into set operations
+        over a TagIndex. The language combines tag terms with AND/OR/NOT:
+            key=value      the ASG has the tag with exactly this value
+            key^=prefix    the ASG has the tag with a value starting with prefix
+            key            the ASG has the tag, whatever its value
+            a & b, a | b, !a, (a)   also written a and b, a or b, not a
+        Keys and values may be quoted to hold spaces or operator characters,
+        e.g. team=payments & (env=prod | env^=staging) & !"do not scale"
+    """
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self._tokens = self._tokenize(text)
+        self._position = 0
+        self.tree = self._parse_or()
+        if self._position != len(self._tokens):
+            raise ValueError('Unexpected {!r} in selector {!r}'.format(
+                self._tokens[self._position][1], text))
+        del self._tokens
+        self.matches = self._predicate(self.tree)
+
+    @staticmethod
+    def _tokenize(text: str) -> list:
+        tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = _SELECTOR_TOKEN.match(text, position)
+            if match is None:
+                raise ValueError('Invalid selector {!r} at {}'.format(text, position))
+            quoted, operator, word = match.groups()
+            if quoted:
+                tokens.append(('word', re.sub(r'\\(.)', r'\1', quoted[1:-1])))
+            elif operator:
+                tokens.append(('op', operator))
+            elif word.lower() in _SELECTOR_KEYWORDS:
+                tokens.append(('op', _SELECTOR_KEYWORDS[word.lower()]))
+            else:
+                tokens.append(('word', word))
+            position = match.end()
+        return tokens
+
+    def _peek(self, kind: str, value: str = None) -> bool:
+        if self._position >= len(self._tokens):
+            return False
+        token_kind, token_value = self._tokens[self._position]
+        return token_kind == kind and value in (None, token_value)
+
+    def _take(self, kind: str, value: str = None) -> str:
+        if not self._peek(kind, value):
+            found = self._tokens[self._position][1] if self._position < len(self._tokens) \
+                else 'end'
+            raise ValueError('Expected {} but found {!r} in selector {!r}'.format(
+                value or kind, found, self.text))
+        self._position += 1
+        return self._tokens[self._position - 1][1]
+
+    def _parse_or(self) -> tuple:
+        operands = [self._parse_and()]
+        while self._peek('op', '|'):
+            self._take('op', '|')
+            operands.append(self._parse_and())
+        return operands[0] if len(operands) == 1 else ('or',) + tuple(operands)
+
+    def _parse_and(self) -> tuple:
+        operands = [self._parse_not()]
+        while self._peek('op', '&'):
+            self._take('op', '&')
+            operands.append(self._parse_not())
+        return operands[0] if len(operands) == 1 else ('and',) + tuple(operands)
+
+    def _parse_not(self) -> tuple:
+        if self._peek('op', '!'):
+            self._take('op', '!')
+            return ('not', self._parse_not())
+        if self._peek('op', '('):
+            self._take('op', '(')
+            tree = self._parse_or()
+            self._take('op', ')')
+            return tree
+        key = self._take('word')
+        if self._peek('op', '='):
+            self._take('op', '=')
+            return ('eq', key, self._take('word'))
+        if self._peek('op', '^='):
+            self._take('op', '^=')
+            return ('prefix', key, self._take('word'))
+        return ('has', key)
+
+    def _predicate(self, tree: tuple):
+        """
+            Compiles the syntax tree into a predicate over AsgRecord
+        """
+        operator = tree[0]
+        if operator == 'eq':
+            pair = tree[1:]
+            return lambda record: pair in record.tags
+        if operator == 'prefix':
+            key, prefix = tree[1:]
+            return lambda record: any(tag_key == key and tag_value.startswith(prefix)
+                                      for tag_key, tag_value in record.tags)
+        if operator == 'has':
+            key = tree[1]
+            return lambda record: any(tag_key == key for tag_key, _ in record.tags)
+        operands = [self._predicate(operand) for operand in tree[1:]]
+        if operator == 'not':
+            operand = operands[0]
+            return lambda record: not operand(record)
+        if operator == 'and':
+            return lambda record: all(operand(record) for operand in operands)
+        return lambda record: any(operand(record) for operand in operands)
+
+    def required_tag(self) -> tuple:
+        """
+            Returns a (key, value) tag every selected ASG must have, usable as a
+            server side filter, None when the selector has no such term
+        """
+        terms = self.tree[1:] if self.tree[0] == 'and' else (self.tree,)
+        for term in terms:
+            if term[0] == 'eq':
+                return term[1:]
+        return None
+
+    def select(self, index: 'TagIndex') -> set:
+        """
+            Returns the names of the ASG of the index matched by the selector
+        """
+        return self._select(self.tree, index)
+
+    def _select(self, tree: tuple, index: 'TagIndex') -> set:
+        operator = tree[0]
+        if operator == 'eq':
+            # a copy, callers of select() may change the result
+            return set(index.groups.get(tree[1:], ()))
+        if operator == 'prefix':
+            return index.with_prefix(*tree[1:])
+        if operator == 'has':
+            return index.with_key(tree[1])
+        if operator == 'not':
+            return index.records.keys() - self._select(tree[1], index)
+        selected = [self._select(operand, index) for operand in tree[1:]]
+        if operator == 'and':
+            # intersecting from the smallest set keeps the work proportional to the result
+            selected.sort(key=len)
+            return set(selected[0]).intersection(*selected[1:])
+        return set().union(*selected)
+
+    def __repr__(self) -> str:
+        return 'TagSelector({!r})'.format(self.text)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_selector(text: str) -> TagSelector:
+    """
+        Returns the compiled TagSelector of a selector text, each text is parsed once
+    """
+    return TagSelector(text)
+
+
+class TagIndex:
+    """
+        Inverted index of the ASG records by tag, built from one inventory
+        pagination so any number of selectors are evaluated without another API call
+    """
+    def __init__(self, records=()) -> None:
+        # ASG name -> AsgRecord
+        self.records = {}
+        # (key, value) -> names of the ASG having the tag
+        self.groups = collections.defaultdict(set)
+        # key -> sorted values, built on first prefix lookup
+        self._values = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, record: AsgRecord) -> None:
+        """
+            Indexes one ASG record
+        """
+        self.records[record.name] = record
+        for pair in record.tags:
+            self.groups[pair].add(record.name)
+        self._values = {}
+
+    def _sorted_values(self, key: str) -> list:
+        if not self._values:
+            values = collections.defaultdict(list)
+            for tag_key, tag_value in self.groups:
+                values[tag_key].append(tag_value)
+            self._values = {tag_key: sorted(tag_values)
+                            for tag_key, tag_values in values.items()}
+        return self._values.get(key, [])
+
+    def with_key(self, key: str) -> set:
+        """
+            Returns the names of the ASG having the tag key
+        """
+        return set().union(*(self.groups[(key, value)] for value in self._sorted_values(key)))
+
+    def with_prefix(self, key: str, prefix: str) -> set:
+        """
+            Returns the names of the ASG having the tag key with a value starting with prefix
+        """
+        values = self._sorted_values(key)
+        names = set()
+        for position in range(bisect.bisect_left(values, prefix), len(values)):
+            if not values[position].startswith(prefix):
+                break
+            names |= self.groups[(key, values[position])]
+        return names
+
+    def select(self, selector) -> list:
+        """
+            Returns the records matched by a selector, text or TagSelector, sorted by name
+        """
+        if isinstance(selector, str):
+            selector = compile_selector(selector)
+        return [self.records[name] for name in sorted(selector.select(self))]
+
+
+class AsgSnapshotCache:
+    """
+        On-disk snapshot of the ASG records used by a sweep, compacted to the
+        name, desired and maximum capacity of the ASG matched by the tag filter.
+        The snapshot saves the pagination of the account, it never decides a write:
+        the ASG that can still be increased are described again before every use.
+        The ASG at their maximum are reused as is for ttl seconds, after that they are
+        described again too, and after full_ttl seconds the whole account is paginated
+        again to pick up new ASG.
+    """
+    def __init__(self, path: str, ttl: float = None, full_ttl: float = None) -> None:
+        self.path = path
+        self.ttl = float(ttl if ttl is not None else os.getenv('ASG_CACHE_TTL', '300'))
+        self.full_ttl = float(
+            full_ttl if full_ttl is not None else os.getenv('ASG_CACHE_FULL_TTL', '3600'))
+        self._lock = threading.Lock()
+        self.filter = None
+        self.fetched_at = 0.0
+        self.refreshed_at = 0.0
+        # ASG name -> [desired, min, max]
+        self.groups = {}
+        # ASG modified since they were cached, always described again
+        self.dirty = set()
+        self.load()
+
+    def load(self) -> None:
+        """
+            Loads the snapshot file, a missing or unreadable file leaves the cache empty
+        """
+        try:
+            with open(self.path, encoding='utf-8') as snapshot:
+                data = json.load(snapshot)
+        except (OSError, ValueError):
+            return
+        self.filter = data.get('filter')
+        self.fetched_at = data.get('fetched_at', 0.0)
+        self.refreshed_at = data.get('refreshed_at', 0.0)
+        self.groups = data.get('groups', {})
+        self.dirty = set(data.get('dirty', []))
+
+    def save(self) -> None:
+        """
+            Atomically writes the snapshot file
+        """
+        with self._lock:
+            data = {'filter': self.filter, 'fetched_at': self.fetched_at,
+                    'refreshed_at': self.refreshed_at, 'groups': self.groups,
+                    'dirty': sorted(self.dirty)}
+        temp_path = '{}.tmp'.format(self.path)
+        with open(temp_path, 'w', encoding='utf-8') as snapshot:
+            json.dump(data, snapshot, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+
+    def reset(self, key: str, value: str, now: float) -> None:
+        """
+            Empties the snapshot before a full pagination with the given tag filter
+        """
+        with self._lock:
+            self.filter = [key, value]
+            self.fetched_at = self.refreshed_at = now
+            self.groups = {}
+            self.dirty = set()
+
+    def put(self, record: AsgRecord) -> None:
+        """
+            Stores the capacities of one ASG record
+        """
+        with self._lock:
+            self.groups[record.name] = [record.desired, record.min_size, record.max_size]
+
+    def remove(self, name: str) -> None:
+        """
+            Forgets an ASG which no longer exists or no longer matches the filter
+        """
+        with self._lock:
+            self.groups.pop(name, None)
+
+    def invalidate(self, name: str) -> None:
+        """
+            Marks an ASG modified by the sweep, it is described again on the next use
+        """
+        with self._lock:
+            self.dirty.add(name)
+
+    def validate(self, names) -> None:
+        """
+            Clears the invalidation of ASG which have just been described again
+        """
+        with self._lock:
+            self.dirty.difference_update(names)
+
+    def records(self) -> list:
+        """
+            Returns the cached ASG as records, without their tags
+        """
+        with self._lock:
+            return [AsgRecord(name, desired, min_size, max_size)
+                    for name, (desired, min_size, max_size) in self.groups.items()]
+
+
+class AsgSweepJournal:
+    """
+        Append-only journal of the ASG handled by a sweep, one JSON entry per line.
+        A sweep restarted after an interruption skips the ASG already handled,
+        an increase is journaled before and after its set_desired_capacity call
+        so an increase interrupted in between is not applied twice.
+        The journal is only resumed when its sweep did not finish and
+        started less than window seconds ago.
+    """
+    def __init__(self, path: str, window: float = None) -> None:
+        self.path = path
+        self.window = float(window if window is not None else
+                            os.getenv('ASG_JOURNAL_WINDOW', '3600'))
+        self._lock = threading.Lock()
+        self._file = None
+        # ASG name -> True if increased, False if untouched
+        self.done = {}
+        # ASG name -> desired capacity being applied
+        self.pending = {}
+
+    def _read(self) -> list:
+        """
+            Returns the entries of the journal file, a line torn by the
+            interruption and a missing file are ignored
+        """
+        entries = []
+        try:
+            with open(self.path, encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        return entries
+
+    def begin(self, now: float = None) -> int:
+        """
+            Resumes the unfinished sweep of the journal, or starts a new one
+
+            Returns
+            -------
+            resumed : int
+                Number of ASG already handled by the resumed sweep
+        """
+        now = time.time() if now is None else now
+        entries = self._read()
+        resume = bool(entries) and now - entries[0].get('started_at', 0) < self.window \
+            and not any(entry.get('finished') for entry in entries)
+        with self._lock:
+            self.done, self.pending = {}, {}
+            if resume:
+                for entry in entries[1:]:
+                    if 'desired' in entry:
+                        self.pending[entry['group']] = entry['desired']
+                    elif 'increased' in entry:
+                        self.pending.pop(entry['group'], None)
+                        self.done[entry['group']] = entry['increased']
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+            if not resume:
+                self._write({'started_at': now})
+        return len(self.done)
+
+    def _write(self, entry: dict) -> None:
+        # flushed line by line, a killed container loses at most the entry being written
+        self._file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._file.flush()
+
+    def append(self, entry: dict) -> None:
+        """
+            Appends one entry, the sweep is begun first when needed
+        """
+        if self._file is None:
+            self.begin()
+        with self._lock:
+            self._write(entry)
+
+    def handled(self, asg: AsgRecord) -> bool:
+        """
+            Returns True if the ASG has been handled by the sweep, an increase which
+            was interrupted counts as handled when the ASG already has its new capacity
+        """
+        with self._lock:
+            if asg.name in self.done:
+                return True
+            target = self.pending.get(asg.name)
+        if target is not None and asg.desired >= target:
+            self.complete(asg.name, True)
+            return True
+        return False
+
+    def intent(self, name: str, new_desired: int) -> None:
+        """
+            Journals an increase right before it is applied
+        """
+        self.append({'group': name, 'desired': new_desired})
+        with self._lock:
+            self.pending[name] = new_desired
+
+    def complete(self, name: str, increased: bool) -> None:
+        """
+            Journals a handled ASG
+        """
+        self.append({'group': name, 'increased': increased})
+        with self._lock:
+            self.pending.pop(name, None)
+            self.done[name] = increased
+
+    def finish(self) -> None:
+        """
+            Marks the sweep finished, the next sweep starts a new journal
+        """
+        self.append({'finished': True})
+        with self._lock:
+            self._file.close()
+            self._file = None
+
+
+class AsgDecisionReport:
+    """
+        Streams one JSON line per processed ASG, with its capacities, whether it has a
+        scaling policy, the action taken, the processing latency and the error raised.
+        Lines are written as the ASG are processed and never kept, so memory stays
+        constant whatever the size of the fleet. The file is appended to, every line
+        carries the start time of its sweep, and is gzip compressed when the path ends
+        with .gz, as a gzip member per sweep which gzip readers concatenate.
+        With a (region, role_arn) target every line also carries its region and role.
+    """
+    def __init__(self, path: str, compress: bool = None, target: tuple = None) -> None:
+        self.path = path
+        self.compress = path.endswith('.gz') if compress is None else compress
+        self.target = target
+        self._lock = threading.Lock()
+        self._file = None
+        self.sweep = None
+        self.written = 0
+
+    def begin(self) -> None:
+        """
+            Starts the lines of a new sweep
+        """
+        with self._lock:
+            self._close()
+            self._open()
+
+    def _open(self) -> None:
+        if self.compress:
+            import gzip
+            self._file = gzip.open(self.path, 'at', encoding='utf-8')
+        else:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self.sweep = time.time()
+        self.written = 0
+
+    def write(self, asg: AsgRecord, action: str, new_desired: int = None, policy: bool = None,
+              latency: float = 0.0, error: str = None) -> None:
+        """
+            Writes the decision line of one ASG, the sweep is begun first when needed
+
+            Parameters
+            ----------
+            asg : AsgRecord
+                Processed ASG, as it was before the decision
+            action : str
+                REASON_INCREASE, REASON_AT_MAX, REASON_NO_POLICY or 'error'
+            new_desired : int
+                Desired capacity after the decision, None on error
+            policy : bool
+                True if the ASG has a scaling policy, None when it was not checked
+            latency : float
+                Seconds spent processing the ASG
+            error : str
+                Error raised while processing the ASG
+        """
+        with self._lock:
+            if self._file is None:
+                self._open()
+            line = {'sweep': self.sweep, 'group': asg.name, 'desired': asg.desired,
+                    'max': asg.max_size, 'policy': policy, 'action': action,
+                    'new_desired': new_desired, 'latency': round(latency, 6), 'error': error}
+            if self.target is not None:
+                line['region'], line['role_arn'] = self.target
+            self._file.write(json.dumps(line, separators=(',', ':')) + '\n')
+            self.written += 1
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self) -> None:
+        """
+            Ends the sweep, flushing and closing the file
+        """
+        with self._lock:
+            self._close()
+
+
+class AsgMetrics:
+    """
+        Per operation call counts, latency histograms, retries, throttles and bytes
+        received by an autoscaling client since it was created, plus the time spent in
+        each phase and the outcomes of the last sweep, reset by begin_sweep().
+        Botocore clients are instrumented through their event hooks, other clients
+        can report their calls with observe(). With a (region, role_arn) target the
+        exports carry its region and role, as labels of every Prometheus series.
+    """
+    # upper bounds in seconds of the latency histogram buckets
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    THROTTLING_CODES = {'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+                        'TooManyRequestsException', 'RequestThrottled'}
+
+    def __init__(self, json_path: str = None, prometheus_path: str = None,
+                 target: tuple = None) -> None:
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.target = target
+        self._lock = threading.Lock()
+        self.operations = {}
+        self.phases = collections.Counter()
+        self.outcomes = collections.Counter()
+
+    def attach(self, client) -> None:
+        """
+            Registers the metric hooks on the event system of a botocore client
+        """
+        events = getattr(getattr(client, 'meta', None), 'events', None)
+        if events is None:
+            return
+        # unique ids, so attaching twice to the same client does not count twice
+        for event, handler in (('before-call', self._before_call),
+                               ('after-call', self._after_call),
+                               ('after-call-error', self._after_call_error),
+                               ('needs-retry', self._needs_retry)):
+            events.register('{}.autoscaling'.format(event), handler,
+                            unique_id='asg-metrics-{}-{}'.format(event, id(self)))
+
+    def _operation(self, name: str) -> dict:
+        """
+            Returns the counters of one operation, the lock must be held
+        """
+        if name not in self.operations:
+            self.operations[name] = {'calls': 0, 'errors': 0, 'retries': 0, 'throttles': 0,
+                                     'bytes': 0, 'latency_sum': 0.0,
+                                     'latency_buckets': [0] * (len(self.BUCKETS) + 1)}
+        return self.operations[name]
+
+    def observe(self, operation: str, seconds: float, bytes_received: int = 0,
+                retries: int = 0, error: bool = False) -> None:
+        """
+            Records one completed API call
+
+            Parameters
+            ----------
+            operation : str
+                API operation name, e.g. DescribeAutoScalingGroups
+            seconds : float
+                Latency of the call including its retries
+            bytes_received : int
+                Size of the response body
+            retries : int
+                Number of retries the call needed
+            error : bool
+                True if the call ended with an error
+        """
+        with self._lock:
+            counters = self._operation(operation)
+            counters['calls'] += 1
+            counters['errors'] += int(error)
+            counters['retries'] += retries
+            counters['bytes'] += bytes_received
+            counters['latency_sum'] += seconds
+            counters['latency_buckets'][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+    def _before_call(self, context: dict = None, **_kwargs) -> None:
+        if context is not None:
+            context['asg_metrics_start'] = time.perf_counter()
+
+    def _after_call(self, model=None, http_response=None, parsed=None, context=None,
+                    **_kwargs) -> None:
+        start = (context or {}).get('asg_metrics_start', time.perf_counter())
+        parsed = parsed or {}
+        bytes_received = 0
+        if http_response is not None:
+            bytes_received = http_response.headers.get('content-length')
+            if bytes_received is None:
+                try:
+                    bytes_received = len(http_response.content or b'')
+                except AttributeError:
+                    # stubbed responses have no raw body to read
+                    bytes_received = 0
+        self.observe(model.name, time.perf_counter() - start, int(bytes_received),
+                     parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                     'Error' in parsed)
+
+    def _after_call_error(self, model=None, context=None, **_kwargs) -> None:
+        start = (context or {}).get('asg_metrics_start', time.perf_counter())
+        self.observe(model.name, time.perf_counter() - start, error=True)
+
+    def _needs_retry(self, response=None, operation=None, **_kwargs) -> None:
+        # response is None on connection errors, (http_response, parsed) otherwise
+        if response is not None and operation is not None and \
+                response[1].get('Error', {}).get('Code') in self.THROTTLING_CODES:
+            with self._lock:
+                self._operation(operation.name)['throttles'] += 1
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+            Context manager adding the time spent in its block to the given phase
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] += time.perf_counter() - start
+
+    def timed(self, iterable, name: str):
+        """
+            Passes the items of iterable through, adding the time spent
+            waiting for each item (e.g. for a page to arrive) to the given phase
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def begin_sweep(self) -> None:
+        """
+            Starts the phases and outcomes of a new sweep, the API call counters
+            are kept across sweeps
+        """
+        with self._lock:
+            self.phases.clear()
+            self.outcomes.clear()
+
+    def record_results(self, results: dict, skipped: int = 0) -> None:
+        """
+            Counts the outcome of every ASG of a sweep, and the ASG it skipped
+        """
+        with self._lock:
+            if skipped:
+                self.outcomes['skipped'] += skipped
+            for outcome in results.values():
+                if outcome is True:
+                    self.outcomes['increased'] += 1
+                elif outcome is False:
+                    self.outcomes['untouched'] += 1
+                else:
+                    self.outcomes['error'] += 1
+
+    def to_dict(self) -> dict:
+        """
+            Returns the JSON summary of the metrics
+        """
+        with self._lock:
+            operations = {}
+            for name, counters in self.operations.items():
+                operations[name] = dict(counters, latency_buckets=dict(zip(
+                    [str(bound) for bound in self.BUCKETS] + ['+Inf'],
+                    itertools.accumulate(counters['latency_buckets']))))
+            summary = {'operations': operations, 'phases': dict(self.phases),
+                       'outcomes': dict(self.outcomes)}
+        if self.target is not None:
+            summary['region'], summary['role_arn'] = self.target
+        return summary
+
+    def to_prometheus(self) -> str:
+        """
+            Returns the metrics in the Prometheus text exposition format
+        """
+        summary = self.to_dict()
+        # labels of the target, appended to the labels of every series
+        target = '' if self.target is None else ',region="{}",role_arn="{}"'.format(
+            self.target[0] or '', self.target[1] or '')
+        lines = []
+        metric_counters = (('calls', 'asg_api_calls_total', 'API calls'),
+                           ('errors', 'asg_api_errors_total', 'API calls ended with an error'),
+                           ('retries', 'asg_api_retries_total', 'API call retries'),
+                           ('throttles', 'asg_api_throttles_total', 'Throttled API attempts'),
+                           ('bytes', 'asg_api_received_bytes_total', 'Response bytes received'))
+        for key, metric, help_text in metric_counters:
+            lines += ['# HELP {} {}'.format(metric, help_text), '# TYPE {} counter'.format(metric)]
+            lines += ['{}{{operation="{}"{}}} {}'.format(metric, name, target, counters[key])
+                      for name, counters in summary['operations'].items()]
+        lines += ['# HELP asg_api_latency_seconds API call latency',
+                  '# TYPE asg_api_latency_seconds histogram']
+        for name, counters in summary['operations'].items():
+            lines += ['asg_api_latency_seconds_bucket{{operation="{}",le="{}"{}}} {}'.format(
+                name, bound, target, count) for bound, count in counters['latency_buckets'].items()]
+            lines.append('asg_api_latency_seconds_sum{{operation="{}"{}}} {}'.format(
+                name, target, counters['latency_sum']))
+            lines.append('asg_api_latency_seconds_count{{operation="{}"{}}} {}'.format(
+                name, target, counters['calls']))
+        lines += ['# HELP asg_phase_seconds Time spent in each phase of the last sweep',
+                  '# TYPE asg_phase_seconds gauge']
+        lines += ['asg_phase_seconds{{phase="{}"{}}} {}'.format(name, target, seconds)
+                  for name, seconds in summary['phases'].items()]
+        lines += ['# HELP asg_sweep_groups ASG of the last sweep by outcome',
+                  '# TYPE asg_sweep_groups gauge']
+        lines += ['asg_sweep_groups{{outcome="{}"{}}} {}'.format(outcome, target, count)
+                  for outcome, count in summary['outcomes'].items()]
+        return '\n'.join(lines) + '\n'
+
+    def export(self) -> None:
+        """
+            Atomically writes the JSON summary and the Prometheus textfile
+            to the configured paths
+        """
+        for path, render in ((self.json_path, lambda: json.dumps(self.to_dict(), indent=2)),
+                             (self.prometheus_path, self.to_prometheus)):
+            if not path:
+                continue
+            temp_path = '{}.tmp'.format(path)
+            with open(temp_path, 'w', encoding='utf-8') as export_file:
+                export_file.write(render())
+            os.replace(temp_path, path)
+
+
+class TokenBucket:
+    """
+        Token bucket refilled at rate tokens per second up to burst tokens.
+        The bucket is shared by every thread of the process, with shared=True its
+        state lives in shared memory so it can be handed to worker processes too.
+    """
+    def __init__(self, rate: float, burst: float = None, shared: bool = False) -> None:
+        if rate <= 0:
+            raise ValueError('Token bucket rate must be positive, got {}'.format(rate))
+        # a bucket holding less than one token never fills enough for an acquire()
+        if burst is not None and burst < 1:
+            raise ValueError('Token bucket burst must be at least 1, got {}'.format(burst))
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(self.rate, 1.0))
+        if shared:
+            import multiprocessing
+            # [available tokens, monotonic time of the last refill]
+            self._state = multiprocessing.Array('d', [self.burst, time.monotonic()])
+            self._lock = self._state.get_lock()
+        else:
+            self._state = [self.burst, time.monotonic()]
+            self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+            Takes tokens from the bucket, sleeping until enough have been refilled
+
+            Returns
+            -------
+            waited : float
+                Seconds spent waiting for the tokens
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                available = min(self.burst, self._state[0] + (now - self._state[1]) * self.rate)
+                self._state[1] = now
+                if available >= tokens:
+                    self._state[0] = available - tokens
+                    return waited
+                self._state[0] = available
+                delay = (tokens - available) / self.rate
+            # sleeping outside the lock lets the other callers refill and take in turn
+            time.sleep(delay)
+            waited += delay
+
+
+class AsgRateLimiter:
+    """
+        Client side rate limiter holding one token bucket per API operation, applied to
+        an autoscaling client through its before-send hook so every attempt of the
+        describe_auto_scaling_groups, describe_policies and set_desired_capacity calls,
+        retries included, waits for a token instead of being throttled by the service.
+    """
+    def __init__(self, budgets: dict, shared: bool = False) -> None:
+        """
+            Parameters
+            ----------
+            budgets : dict
+                (rate, burst) per operation name, e.g. DescribeAutoScalingGroups,
+                '*' applies to the operations not listed
+            shared : bool
+                True to keep the buckets in shared memory for worker processes
+        """
+        self.buckets = {operation: TokenBucket(rate, burst, shared=shared)
+                        for operation, (rate, burst) in budgets.items()}
+        self.waited = collections.Counter()
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # the shared buckets are pickled for the worker processes, the lock is per process
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_budgets(spec: str) -> dict:
+        """
+            Parses a comma separated list of operation=rate[:burst] budgets, operations are
+            given as in the API (SetDesiredCapacity) or as client methods (set_desired_capacity)
+
+            Returns
+            -------
+            budgets : dict
+                (rate, burst) per operation name, burst is None when not given
+
+            Raises
+            ------
+            ValueError
+                When a rate is not a positive number or a burst is below 1
+        """
+        budgets = {}
+        for item in spec.split(','):
+            if not item.strip():
+                continue
+            operation, _, budget = item.partition('=')
+            operation = operation.strip()
+            if '_' in operation:
+                operation = ''.join(part.title() for part in operation.split('_'))
+            rate, _, burst = budget.partition(':')
+            rate = float(rate)
+            if not rate > 0:
+                raise ValueError('ASG_RATE_LIMITS rate of {} must be positive, got {}'.format(
+                    operation, rate))
+            burst = float(burst) if burst.strip() else None
+            if burst is not None and not burst >= 1:
+                raise ValueError('ASG_RATE_LIMITS burst of {} must be at least 1, got {}'.format(
+                    operation, burst))
+            budgets[operation] = (rate, burst)
+        return budgets
+
+    @classmethod
+    def from_env(cls, shared: bool = None):
+        """
+            Returns the rate limiter configured by ASG_RATE_LIMITS and ASG_RATE_LIMIT_SHARED,
+            None when no budget is configured
+        """
+        budgets = cls.parse_budgets(os.getenv('ASG_RATE_LIMITS', ''))
+        if not budgets:
+            return None
+        if shared is None:
+            shared = os.getenv('ASG_RATE_LIMIT_SHARED', 'false').lower() == 'true'
+        return cls(budgets, shared=shared)
+
+    def attach(self, client) -> None:
+        """
+            Registers the limiter on the event system of a botocore client
+        """
+        events = getattr(getattr(client, 'meta', None), 'events', None)
+        if events is None:
+            return
+        # before-send is emitted once per attempt, before-call only once per call
+        events.register('before-send.autoscaling', self._before_send,
+                        unique_id='asg-rate-limiter-{}'.format(id(self)))
+
+    def acquire(self, operation: str) -> float:
+        """
+            Waits for a token of the given operation, returns the seconds waited
+        """
+        bucket = self.buckets.get(operation) or self.buckets.get('*')
+        if bucket is None:
+            return 0.0
+        waited = bucket.acquire()
+        if waited:
+            with self._lock:
+                self.waited[operation] += waited
+        return waited
+
+    def _before_send(self, event_name: str = None, **_kwargs) -> None:
+        # before-send.<service>.<operation>, the handler must return None to send
+        if event_name:
+            self.acquire(event_name.rsplit('.', 1)[-1])
+
+
+class AsgScheduler:
+    """
+        Processes the ASG of a sweep by priority within a time budget. The ASG are
+        ordered by the configured priorities, then handed out one by one while the
+        remaining budget still covers the ASG in flight at the measured cost per ASG,
+        so the sweep stops cleanly before the deadline and reports the skipped ASG.
+        Priorities, highest first:
+            tag         numeric value of the priority tag, missing counts as 0
+            headroom    max - desired
+            last_bump   ASG increased least recently (or never) first
+    """
+    PRIORITIES = ('tag', 'headroom', 'last_bump')
+
+    def __init__(self, asg_count: 'AsgCount', budget: float, priorities: list = None,
+                 priority_tag: str = None, state_path: str = None, margin: float = None,
+                 alpha: float = 0.2) -> None:
+        """
+            Parameters
+            ----------
+            asg_count : AsgCount
+                Processes the ASG, its max_workers sizes the work in flight
+            budget : float
+                Seconds the sweep may last, counted from start()
+            priorities : list of str
+                Order of the priorities, defaults to ASG_PRIORITY or tag,headroom,last_bump
+            priority_tag : str
+                Tag holding the priority of an ASG, defaults to ASG_PRIORITY_TAG or
+                asg-priority
+            state_path : str
+                JSON file keeping the last increase time of every ASG across runs,
+                defaults to ASG_SCHEDULE_STATE, kept in memory when not set
+            margin : float
+                Seconds kept free before the deadline, defaults to ASG_SCHEDULE_MARGIN or 1
+            alpha : float
+                Weight of the last measurement in the moving average of the cost per ASG
+        """
+        self.asg_count = asg_count
+        self.budget = float(budget)
+        self.priorities = priorities or [
+            priority.strip() for priority in
+            os.getenv('ASG_PRIORITY', ','.join(self.PRIORITIES)).split(',') if priority.strip()]
+        unknown = set(self.priorities) - set(self.PRIORITIES)
+        if unknown:
+            raise ValueError('Unknown priorities {}'.format(sorted(unknown)))
+        self.priority_tag = priority_tag or os.getenv('ASG_PRIORITY_TAG', 'asg-priority')
+        self.state_path = state_path or os.getenv('ASG_SCHEDULE_STATE')
+        self.margin = float(margin if margin is not None else
+                            os.getenv('ASG_SCHEDULE_MARGIN', '1'))
+        self.alpha = alpha
+        # ASG name -> time of its last increase
+        self.last_bumped = {}
+        if self.state_path:
+            try:
+                with open(self.state_path, encoding='utf-8') as state:
+                    self.last_bumped = json.load(state)
+            except (OSError, ValueError):
+                pass
+        self.deadline = None
+        # moving average of the seconds each ASG takes, None until measured
+        self.estimate = None
+        self.skipped = []
+
+    def start(self) -> None:
+        """
+            Starts the budget, the time spent listing the ASG counts against it
+        """
+        self.deadline = time.monotonic() + self.budget
+        self.skipped = []
+
+    def priority(self, asg: AsgRecord) -> tuple:
+        """
+            Returns the sort key of an ASG, the most important ASG sorts first
+        """
+        key = []
+        for priority in self.priorities:
+            if priority == 'tag':
+                try:
+                    key.append(-float(asg.tag(self.priority_tag, '0')))
+                except ValueError:
+                    key.append(0.0)
+            elif priority == 'headroom':
+                key.append(asg.desired - asg.max_size)
+            else:
+                key.append(self.last_bumped.get(asg.name, 0.0))
+        return tuple(key)
+
+    def _seed_estimate(self, workers: int) -> float:
+        """
+            Returns the cost per ASG assumed before any is measured, the mean latency
+            of the API calls made so far shared by the workers, None without calls
+        """
+        operations = self.asg_count.metrics.to_dict()['operations'].values()
+        calls = sum(counters['calls'] for counters in operations)
+        if not calls:
+            return None
+        return sum(counters['latency_sum'] for counters in operations) / calls / workers
+
+    def schedule(self, asgs):
+        """
+            Yields the ASG by priority until the remaining budget no longer covers the
+            ASG in flight, the ASG left are recorded in skipped
+
+            Parameters
+            ----------
+            asgs : iterable of AsgRecord
+                ASG of the sweep, all listed before the first one is handed out
+
+            Yields
+            ------
+            asg : AsgRecord
+                Next ASG to process
+        """
+        if self.deadline is None:
+            self.start()
+        ordered = sorted(map(AsgRecord.of, asgs), key=self.priority)
+        workers = self.asg_count.max_workers
+        # process_asgs keeps at most 2 * max_workers ASG waiting in its pool
+        in_flight = 1 if workers == 1 else 2 * workers
+        if self.estimate is None:
+            self.estimate = self._seed_estimate(workers)
+        previous = None
+        for position, asg in enumerate(ordered):
+            now = time.monotonic()
+            # once the pool is full, each ASG is asked for when an earlier one is done
+            if position >= in_flight:
+                if self.estimate is None:
+                    self.estimate = now - previous
+                else:
+                    self.estimate += self.alpha * (now - previous - self.estimate)
+            previous = now
+            if self.deadline - now < (self.estimate or 0.0) * in_flight + self.margin:
+                self.skipped = [skipped.name for skipped in ordered[position:]]
+                self.asg_count.log.warning(
+                    'Time budget nearly spent, skipping %i ASG: %s', len(self.skipped),
+                    ', '.join(self.skipped[:20]) + (' ...' if len(self.skipped) > 20 else ''))
+                return
+            yield asg
+
+    def record(self, results: dict) -> None:
+        """
+            Keeps the time of the increases of a sweep, in the state file when configured
+        """
+        now = time.time()
+        self.last_bumped.update((name, now) for name, outcome in results.items()
+                                if outcome is True)
+        if self.state_path:
+            temp_path = '{}.tmp'.format(self.state_path)
+            with open(temp_path, 'w', encoding='utf-8') as state:
+                json.dump(self.last_bumped, state, separators=(',', ':'))
+            os.replace(temp_path, self.state_path)
+
+    def report(self) -> dict:
+        """
+            Returns the skipped ASG and the measured cost per ASG of the last sweep
+        """
+        return {'skipped': list(self.skipped), 'estimate_seconds': self.estimate,
+                'remaining_seconds': self.deadline - time.monotonic() if self.deadline else None}
 
 
 class AsgCount:
     """
-        Class for increasing ASG desired_count to +1
-        Having functions to get desired count and increasing desired count
+        Class for increasing ASG desired_count to +1
+        Having functions to get desired count and increasing desired count
+    """
+    def __init__(self, asg_client=None, use_policy_index: bool = None,
+                 page_size: int = None, max_workers: int = None, session=None,
+                 snapshot_cache: AsgSnapshotCache = None, metrics: AsgMetrics = None,
+                 rate_limiter: AsgRateLimiter = None, shard_index: int = None,
+                 shard_count: int = None, journal: AsgSweepJournal = None,
+                 selector=None, scheduler: AsgScheduler = None,
+                 decision_report: AsgDecisionReport = None, target: tuple = None) -> None:
+        # number of ASG processed concurrently by run(), 1 keeps the sequential behaviour
+        self.max_workers = max(int(max_workers or os.getenv("ASG_MAX_WORKERS", "1")), 1)
+        self.log = logging.getLogger('Asgcount')
+        # (region, role_arn) swept by a worker of run_targets(), None for a single target,
+        # the files configured by the environment are then kept per target
+        self.target = target
+        self.log.setLevel(os.getenv("LOG_LEVEL", "INFO"))
+        # account-wide set of ASG names having scaling policies, None until built
+        self._policy_index = None
+        if use_policy_index is None:
+            use_policy_index = os.getenv("ASG_POLICY_INDEX", "true").lower() != "false"
+        self.use_policy_index = use_policy_index
+        # describe_auto_scaling_groups accepts at most 100 records per page
+        self.page_size = min(int(page_size or os.getenv("ASG_PAGE_SIZE", "100")), 100)
+        # _server_filter() level in use, raised each time the service rejects its
+        # parameters, the client side filter is used past _SERVER_FILTER_LEVELS
+        self._server_filter_level = 0
+        # optional tag selector, text or TagSelector, replacing the ASG_TAG_NAME/ASG_TAG_VALUE
+        # filter of the sweep, configured by ASG_SELECTOR
+        selector = selector or os.getenv('ASG_SELECTOR')
+        self.selector = compile_selector(selector) if isinstance(selector, str) else selector
+        # optional on-disk snapshot of the ASG records, enabled by ASG_CACHE_PATH
+        if snapshot_cache is None and os.getenv('ASG_CACHE_PATH'):
+            snapshot_cache = AsgSnapshotCache(target_path(os.getenv('ASG_CACHE_PATH'), target))
+        self.snapshot_cache = snapshot_cache
+        # optional checkpoint journal of the sweep, enabled by ASG_JOURNAL_PATH
+        if journal is None and os.getenv('ASG_JOURNAL_PATH'):
+            journal = AsgSweepJournal(target_path(os.getenv('ASG_JOURNAL_PATH'), target))
+        self.journal = journal
+        # optional priority scheduler bounding the sweep to ASG_TIME_BUDGET seconds
+        if scheduler is None and float(os.getenv('ASG_TIME_BUDGET', '0')) > 0:
+            scheduler = AsgScheduler(self, float(os.getenv('ASG_TIME_BUDGET')))
+        self.scheduler = scheduler
+        # optional JSON lines stream of the decisions, enabled by ASG_DECISION_REPORT
+        if decision_report is None and os.getenv('ASG_DECISION_REPORT'):
+            decision_report = AsgDecisionReport(
+                target_path(os.getenv('ASG_DECISION_REPORT'), target), target=target)
+        self.decision_report = decision_report
+        # API call and phase metrics, exported at the end of run() when paths are set
+        self.metrics = metrics or AsgMetrics(
+            json_path=target_path(os.getenv('ASG_METRICS_JSON'), target),
+            prometheus_path=target_path(os.getenv('ASG_METRICS_PROM'), target), target=target)
+        # slice of the fleet handled by this worker, ASG_SHARD_INDEX of ASG_SHARD_COUNT
+        self.shard_index, self.shard_count = get_shard(shard_index, shard_count)
+        # optional per operation token buckets, configured by ASG_RATE_LIMITS
+        self.rate_limiter = rate_limiter or _SHARED_RATE_LIMITER or AsgRateLimiter.from_env()
+        try:
+            # initializing the ASG client, boto3 is only loaded when none is injected
+            if asg_client:
+                self._asg = asg_client
+            elif session is not None:
+                self._asg = session.client(
+                    "autoscaling", config=_client_config(max(self.max_workers, 10)))
+                self.log.info('session initiated')
+            else:
+                # a client of its own, the hooks below must not see other instances' calls
+                self._asg = _default_client(max(self.max_workers, 10), shared=False)
+                self.log.info('session initiated')
+            # every attempt waits for a token, the waits count in the call latency and
+            # are reported apart in rate_limiter.waited
+            if self.rate_limiter is not None:
+                self.rate_limiter.attach(self._asg)
+            self.metrics.attach(self._asg)
+        except _api_errors() as error:
+            logging.warning(error)
+
+    def check_scaling_policy(self, name: str) -> bool:
+        """
+            Used to check whether the given ASG has dynamic scaling policies or not
+            Expects one parameter name of an ASG
+            When a policy index has been built it is a set lookup, no API call is made
+
+
+            Parameters
+            ----------
+            name : str
+                Name of the ASG
+
+            Returns
+            -------
+            - bool
+                The return value is True for success scenario, False otherwise.
+        """
+        if self._policy_index is not None:
+            return name in self._policy_index
+        response = self._asg.describe_policies(
+            AutoScalingGroupName=name)
+        scaling_policy = response.get('ScalingPolicies', None)
+        return bool(scaling_policy)
+
+    def build_policy_index(self) -> set:
+        """
+            Pages through describe_policies once for the whole account and
+            builds the set of ASG names having at least one scaling policy.
+            Once built, check_scaling_policy uses it instead of one call per ASG.
+
+            Returns
+            -------
+            policy_index : set of str
+                Names of the ASG having scaling policies
+        """
+        with self.metrics.phase('policy_index'):
+            paginator = self._asg.get_paginator('describe_policies')
+            iterator = paginator.paginate()
+            self._policy_index = set(iterator.search('ScalingPolicies[].AutoScalingGroupName'))
+        self.log.debug("Total number of Asg's with scaling policy = %s",
+                       str(len(self._policy_index)))
+        return self._policy_index
+
+    def clear_policy_index(self) -> None:
+        """
+            Drops the policy index, check_scaling_policy falls back to describe_policies
+        """
+        self._policy_index = None
+
+    def iter_asgs_filtered(self, key: str, value: str):
+        """
+            Yields the describe records of the asg matched with provided key:value TAG
+            page by page, so callers can start working before the last page arrives
+            and only about one page is held in memory
+
+            Parameters
+            ----------
+            key : str
+                Key of ASG_TAG
+            value : str
+                Value of ASG_TAG
+
+            Yields
+            ------
+            asg : AsgRecord
+                ASG record projected from describe_auto_scaling_groups
+        """
+        kwargs = self._server_filter_kwargs(key, value)
+        while kwargs is not None:
+            yielded = False
+            try:
+                for asg in self._search_asgs(key, value, **kwargs):
+                    yielded = True
+                    yield asg
+                return
+            except _api_errors() as error:
+                self._server_filter_failed(error, yielded)
+            kwargs = self._server_filter_kwargs(key, value)
+        yield from self._search_asgs(key, value)
+
+    def _server_filter_kwargs(self, key: str, value: str):
+        """
+            Returns the describe_auto_scaling_groups arguments of the server side filter
+            on the key:value TAG in use, None when the client side filter is used instead
+        """
+        if key and value and self._server_filter_level < _SERVER_FILTER_LEVELS:
+            return _server_filter(key, value, self._server_filter_level)
+        return None
+
+    def _server_filter_failed(self, error: Exception, yielded: bool) -> None:
+        """
+            Handles the API error of a server side filtered listing, the next filter level
+            is used when the service rejected its parameters, the error is raised otherwise
+        """
+        # records already handed out can not be taken back, only fall back on first
+        # page, and only when the parameters are rejected, not on e.g. throttling
+        if yielded or not _parameters_rejected(error):
+            raise error
+        self.log.warning("Server side tag filter rejected, falling back: %s", error)
+        self._server_filter_level += 1
+
+    def get_asgs_filtered(self, key: str, value: str) -> list:
+        """
+            Returns the records of all the asg matched with provided key:value TAG
+            Records carry desired and max capacity and tags, so a sweep can use them
+            without describing every ASG a second time
+
+            Parameters
+            ----------
+            key : str
+                Key of ASG_TAG
+            value : str
+                Value of ASG_TAG
+
+            Returns
+            -------
+            asg_list : list of AsgRecord
+                List of ASG records projected from describe_auto_scaling_groups
+        """
+        asg_list = list(self.iter_asgs_filtered(key, value))
+        self.log.debug("Total number of Asg's are = %s", str(len(asg_list)))
+        return asg_list
+
+    def _search_asgs(self, key: str, value: str, **kwargs):
+        """
+            Pages through describe_auto_scaling_groups and lazily yields the records
+            having the key:value TAG, kwargs are passed to paginate.
+            The tag is also checked on top of the server side filter,
+            so both paths return exactly the same records.
+        """
+        # the tag is matched on the compact record instead of a JMESPath filter
+        return (record for record in self._paginate_asgs(**kwargs)
+                if (key, value) in record.tags)
+
+    def _paginate_asgs(self, **kwargs):
+        """
+            Pages through describe_auto_scaling_groups and lazily yields every record,
+            kwargs are passed to paginate
+        """
+        # Pagination to avoid long page issue
+        paginator = self._asg.get_paginator('describe_auto_scaling_groups')
+        iterator = paginator.paginate(
+            PaginationConfig={'MaxItems': 100000, 'PageSize': self.page_size}, **kwargs)
+        # projected as they stream, only the current page is held as full documents
+        return (AsgRecord.from_group(group) for group in iterator.search('AutoScalingGroups[]'))
+
+    def iter_asgs_selected(self, selector):
+        """
+            Yields the records of the ASG matched by a tag selector. When every selected
+            ASG must have a key=value tag, the listing is filtered server side on it,
+            otherwise the whole inventory is paginated once.
+
+            Parameters
+            ----------
+            selector : str or TagSelector
+                Tag selector, e.g. team=payments & (env=prod | env^=staging)
+
+            Yields
+            ------
+            asg : AsgRecord
+                ASG record projected from describe_auto_scaling_groups
+        """
+        if isinstance(selector, str):
+            selector = compile_selector(selector)
+        required = selector.required_tag()
+        if required is not None:
+            asgs = self.iter_asgs_filtered(*required)
+        else:
+            asgs = self._paginate_asgs(IncludeInstances=False)
+        return (asg for asg in asgs if selector.matches(asg))
+
+    def build_tag_index(self) -> TagIndex:
+        """
+            Paginates the whole inventory once into an inverted tag index
+        """
+        with self.metrics.phase('tag_index'):
+            return TagIndex(self._paginate_asgs(IncludeInstances=False))
+
+    def select_asgs(self, selectors: list, index: TagIndex = None) -> dict:
+        """
+            Evaluates many tag selectors at the cost of a single inventory pagination
+
+            Parameters
+            ----------
+            selectors : list of str
+                Tag selectors, see TagSelector
+            index : TagIndex
+                Index to evaluate the selectors against, built when not given
+
+            Returns
+            -------
+            selected : dict
+                selector -> list of the matched AsgRecord sorted by name
+        """
+        if index is None:
+            index = self.build_tag_index()
+        return {selector: index.select(selector) for selector in selectors}
+
+    def describe_asgs(self, names: list, key: str, value: str):
+        """
+            Describes the given ASG by name, 50 names per call, and yields the records
+            still matching the key:value TAG
+
+            Parameters
+            ----------
+            names : list of str
+                Names of the ASG
+            key : str
+                Key of ASG_TAG
+            value : str
+                Value of ASG_TAG
+
+            Yields
+            ------
+            asg : AsgRecord
+                ASG record projected from describe_auto_scaling_groups
+        """
+        for batch in self._describe_batches(names):
+            yield from (record for record in batch if (key, value) in record.tags)
+
+    def _describe_batches(self, names: list, batch_size: int = 50):
+        """
+            Describes the given ASG by name and yields the list of records of each batch
+        """
+        names = list(names)
+        for start in range(0, len(names), batch_size):
+            response = self._asg.describe_auto_scaling_groups(
+                AutoScalingGroupNames=names[start:start + batch_size])
+            yield [AsgRecord.from_group(group) for group in response.get('AutoScalingGroups', [])]
+
+    def iter_asgs_cached(self, key: str, value: str, batch_size: int = 50):
+        """
+            Yields the ASG matched with provided key:value TAG from the snapshot cache.
+            A snapshot older than full_ttl, or taken with another filter, is rebuilt from
+            a full pagination. Otherwise the ASG below their maximum capacity, the ones
+            invalidated by a previous sweep and, once the snapshot is older than ttl,
+            every cached ASG are described again by batches right before they are
+            yielded, so only ASG at their maximum are served from the snapshot.
+
+            Parameters
+            ----------
+            key : str
+                Key of ASG_TAG
+            value : str
+                Value of ASG_TAG
+            batch_size : int
+                Number of ASG described per call, at most 50
+
+            Yields
+            ------
+            asg : AsgRecord
+                ASG record, records served from the snapshot carry no tags
+        """
+        cache = self.snapshot_cache
+        now = time.time()
+        if cache.filter != [key, value] or now - cache.fetched_at >= cache.full_ttl:
+            self.log.info('Snapshot cache expired, fetching every ASG')
+            cache.reset(key, value, now)
+            for asg in self.iter_asgs_filtered(key, value):
+                cache.put(asg)
+                yield asg
+            return
+        stale = now - cache.refreshed_at >= cache.ttl
+        if stale:
+            cache.refreshed_at = now
+        names = set(cache.dirty)
+        served = []
+        for asg in cache.records():
+            if stale or asg.desired < asg.max_size:
+                names.add(asg.name)
+            elif asg.name not in names:
+                served.append(asg)
+        self.log.info('Snapshot cache hit, describing %i ASG again', len(names))
+        yield from served
+        names = sorted(names)
+        for start in range(0, len(names), batch_size):
+            batch = set(names[start:start + batch_size])
+            described = list(self.describe_asgs(sorted(batch), key, value))
+            # cleared before the ASG are yielded, the sweep may invalidate them again
+            cache.validate(batch)
+            for asg in described:
+                batch.discard(asg.name)
+                cache.put(asg)
+            # described again but gone, or not matching the tag filter anymore
+            for name in batch:
+                cache.remove(name)
+            yield from described
+
+    def get_names_filtered(self, key: str, value: str) -> list:
+        """
+            Returns the list of all the asg names
+
+            Parameters
+            ----------
+            key : str
+                Key of ASG_TAG
+            value : str
+                Value of ASG_TAG
+
+            Returns
+            -------
+            asg_name_list : list of str
+                List of ASG matched with provided key:value TAG
+        """
+        return [asg.name for asg in self.get_asgs_filtered(key, value)]
+
+    def get_asg_desired_max_capacity(self, asg_name: str) -> tuple:
+        """
+            Returns the desired and maximum capacity of provided asg_name.
+
+            Parameters
+            ----------
+            asg_name : str
+                Name of the ASG
+
+            Returns
+            -------
+            tuple containing int (desired_cap, max_cap)
+            - desired_cap : int
+                desired capacity of the provided ASG
+            - max_cap : int
+                maximum capacity of the provided ASG
+        """
+        response = self._asg.describe_auto_scaling_groups(
+            AutoScalingGroupNames=[
+                asg_name,
+            ])
+        details = response.get('AutoScalingGroups', None)
+        if not details:
+            self.log.warning("Could not find this ASG %s", asg_name)
+            return -1, -1
+        else:
+            desired_cap, max_cap = int(details[0]['DesiredCapacity']), int(details[0]['MaxSize'])
+            self.log.info("%s Desired=%s Maximum=%s", asg_name, str(desired_cap), str(max_cap))
+            return desired_cap, max_cap
+
+    def increase_desired_capacity(self, name: str, new_count: int) -> None:
+        """
+            It takes two parameter ASG name and
+            new desired count value for increasing the ASG to desired value.
+            It doesn't return anything,
+
+            Parameters
+            ----------
+            name : str
+                Name of the ASG
+            new_count : int
+                New desired capacity
+
+            Returns
+            -------
+            None
+        """
+        self._asg.set_desired_capacity(
+            AutoScalingGroupName=name,
+            DesiredCapacity=new_count,
+            HonorCooldown=False
+        )
+
+    def decide(self, asg: AsgRecord) -> tuple:
+        """
+            Takes the +1 decision for one ASG without modifying it
+
+            Parameters
+            ----------
+            asg : AsgRecord
+                ASG record, a describe_auto_scaling_groups document is projected first
+
+            Returns
+            -------
+            tuple (new_desired, reason)
+            - new_desired : int
+                desired capacity the ASG should have
+            - reason : str
+                REASON_INCREASE, REASON_AT_MAX or REASON_NO_POLICY
+        """
+        asg = AsgRecord.of(asg)
+        # the policy is only looked up for ASG below their maximum
+        policy = self.check_scaling_policy(asg.name) if asg.desired < asg.max_size else None
+        return self._decision(asg, policy)
+
+    def _decision(self, asg: AsgRecord, policy: bool) -> tuple:
+        """
+            Returns the (new_desired, reason) decision of decide() once the scaling policy
+            of the ASG is known, policy is None for an ASG at its maximum
+        """
+        name, desired, max_cap = asg.name, asg.desired, asg.max_size
+        self.log.info("%s Desired=%s Maximum=%s", name, str(desired), str(max_cap))
+        if desired >= max_cap:
+            return desired, REASON_AT_MAX
+        if not policy:
+            self.log.info("Scaling policy not exist for %s", name)
+            return desired, REASON_NO_POLICY
+        return desired + 1, REASON_INCREASE
+
+    def process_asg(self, asg: AsgRecord) -> bool:
+        """
+            Applies the +1 decision to one ASG using its paginated describe record,
+            so no extra describe_auto_scaling_groups call is made for it.
+
+            Parameters
+            ----------
+            asg : AsgRecord
+                ASG record, a describe_auto_scaling_groups document is projected first
+
+            Returns
+            -------
+            - bool
+                True if the desired capacity has been increased, False otherwise.
+        """
+        return self._process(AsgRecord.of(asg))[1] == REASON_INCREASE
+
+    def _process(self, asg: AsgRecord) -> tuple:
+        """
+            Takes and applies the decision of process_asg, returns (new_desired, reason)
+        """
+        name = asg.name
+        self.log.info('The ASG: %s', name)
+        new_desired, reason = self.decide(asg)
+        if self._before_write(name, new_desired, reason):
+            # increase desired to +1
+            self.increase_desired_capacity(name, new_desired)
+            self._after_write(name)
+        return new_desired, reason
+
+    def _before_write(self, name: str, new_desired: int, reason: str) -> bool:
+        """
+            Journals the decision taken for an ASG, returns True when it is an increase
+            to write, whose intent is journaled and whose snapshot is invalidated first
+        """
+        if reason != REASON_INCREASE:
+            if self.journal is not None:
+                self.journal.complete(name, False)
+            return False
+        if self.journal is not None:
+            self.journal.intent(name, new_desired)
+        if self.snapshot_cache is not None:
+            # before the write, a failed or interrupted write leaves the ASG unknown
+            self.snapshot_cache.invalidate(name)
+        return True
+
+    def _after_write(self, name: str) -> None:
+        """
+            Journals the increase of an ASG once its desired capacity has been written
+        """
+        if self.journal is not None:
+            self.journal.complete(name, True)
+        self.log.info("Desired Capacity of %s has been increased by 1.", name)
+
+    @staticmethod
+    def get_filter_tags() -> tuple:
+        """
+            Return the filter key and filter value by
+             fetching from container environment variables
+             takes no argumentcmd
+
+            Returns
+            -------
+            tuple containing str (filter_key, filter_value)
+            - filter_key : str
+                Tag name used to filter the ASG
+            - filter_value : str
+                Tag value used to filter the ASG
+        """
+        filter_key = os.getenv('ASG_TAG_NAME')
+        filter_value = os.getenv('ASG_TAG_VALUE')
+        return filter_key, filter_value
+
+    def _process_asg_safe(self, asg: AsgRecord):
+        """
+            Runs process_asg and returns the raised API error instead of propagating it,
+            so one failing ASG does not stop the rest of the sweep, the decision is
+            written to the decision report when one is configured
+        """
+        start = time.perf_counter()
+        try:
+            new_desired, reason = self._process(asg)
+        except _api_errors() as error:
+            return self._failed(asg, error, start)
+        return self._processed(asg, new_desired, reason, start)
+
+    def _failed(self, asg: AsgRecord, error: Exception, start: float):
+        """
+            Logs and reports the API error raised while processing an ASG since start,
+            a time.perf_counter() value, and returns it as the outcome of the ASG
+        """
+        self.log.warning("Failed to process %s: %s", asg.name, error)
+        if self.decision_report is not None:
+            self.decision_report.write(asg, 'error', latency=time.perf_counter() - start,
+                                       error=str(error))
+        return error
+
+    def _processed(self, asg: AsgRecord, new_desired: int, reason: str, start: float) -> bool:
+        """
+            Reports the decision applied to an ASG since start, a time.perf_counter() value,
+            and returns True if the desired capacity has been increased
+        """
+        if self.decision_report is not None:
+            if reason == REASON_AT_MAX:
+                # the policy is only looked up for ASG below their maximum
+                policy = asg.name in self._policy_index if self._policy_index is not None \
+                    else None
+            else:
+                policy = reason == REASON_INCREASE
+            self.decision_report.write(asg, reason, new_desired, policy,
+                                       time.perf_counter() - start)
+        return reason == REASON_INCREASE
+
+    def process_asgs(self, asgs) -> dict:
+        """
+            Applies process_asg to every given ASG, using a pool of max_workers
+            threads when max_workers is greater than 1
+            asgs may be a generator, it is consumed as the ASG are processed and
+            at most 2 * max_workers ASG are waiting in the pool at any time
+
+            Parameters
+            ----------
+            asgs : iterable of AsgRecord
+                ASG records, describe_auto_scaling_groups documents are projected first
+
+            Returns
+            -------
+            results : dict
+                ASG name -> True if increased, False if untouched, or the API error raised
+        """
+        results = {}
+        if self.max_workers == 1:
+            for asg in map(AsgRecord.of, asgs):
+                results[asg.name] = self._process_asg_safe(asg)
+            return results
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for asg in map(AsgRecord.of, asgs):
+                if len(pending) >= 2 * self.max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[pending.pop(future)] = future.result()
+                pending[executor.submit(self._process_asg_safe, asg)] = asg.name
+            for future in wait(pending).done:
+                results[pending[future]] = future.result()
+        return results
+
+    def _with_policy_index(self, asgs):
+        """
+            Passes the ASG records through, building the policy index right before
+            the first ASG which is below its maximum capacity
+        """
+        for asg in asgs:
+            if self.use_policy_index and self._policy_index is None \
+                    and asg.desired < asg.max_size:
+                # one account-wide describe_policies pass instead of one call per ASG
+                self.build_policy_index()
+            yield asg
+
+    def _iter_sweep_asgs(self, key: str, value: str, observe=None):
+        """
+            Yields the ASG of a sweep in the shard of this worker and not yet handled
+            according to the journal, matched by the selector when one is configured and
+            by the key:value TAG otherwise, from the snapshot cache when one is configured,
+            and builds the policy index before the first ASG below maximum capacity.
+            observe is called with every ASG of the shard, handled ones included.
+        """
+        # stream ASG records with only matched key:value, the records already carry
+        # desired and max capacity so each ASG is described only once per sweep
+        if self.selector is not None:
+            # the snapshot only keeps capacities, a selector needs the tags of every ASG
+            asgs = self.iter_asgs_selected(self.selector)
+        elif self.snapshot_cache is not None:
+            asgs = self.iter_asgs_cached(key=key, value=value)
+        else:
+            asgs = self.iter_asgs_filtered(key=key, value=value)
+        if self.shard_count > 1:
+            asgs = (asg for asg in asgs
+                    if in_shard(asg.name, self.shard_index, self.shard_count))
+        if observe is not None:
+            asgs = _observed(asgs, observe)
+        if self.journal is not None:
+            # ASG handled before the sweep was interrupted
+            asgs = (asg for asg in asgs if not self.journal.handled(asg))
+        # time spent waiting on pages is reported apart from the processing
+        return self._with_policy_index(self.metrics.timed(asgs, 'pagination'))
+
+    def in_sweep(self, asg: AsgRecord) -> bool:
+        """
+            Returns True if the ASG is matched by the filter of the sweep,
+            the selector or the key:value TAG, and is in the shard of this worker
+        """
+        if self.selector is not None:
+            matched = self.selector.matches(asg)
+        else:
+            matched = self.get_filter_tags() in asg.tags
+        return matched and in_shard(asg.name, self.shard_index, self.shard_count)
+
+    def plan(self, asgs) -> list:
+        """
+            Turns ASG records into a capacity plan without modifying any ASG
+
+            Parameters
+            ----------
+            asgs : iterable of AsgRecord
+                ASG records, describe_auto_scaling_groups documents are projected first
+
+            Returns
+            -------
+            plan : list of dict
+                One entry per ASG with group, desired, max, new_desired and reason
+        """
+        plan = []
+        for asg in map(AsgRecord.of, asgs):
+            new_desired, reason = self.decide(asg)
+            plan.append({'group': asg.name, 'desired': asg.desired, 'max': asg.max_size,
+                         'new_desired': new_desired, 'reason': reason})
+        return plan
+
+    def plan_sweep(self) -> list:
+        """
+            Plans a sweep over the ASG matched by the container tag filter,
+            costing only the describe calls
+
+            Returns
+            -------
+            plan : list of dict
+                One entry per ASG with group, desired, max, new_desired and reason
+        """
+        filter_key, filter_value = self.get_filter_tags()
+        self.clear_policy_index()
+        with self.metrics.phase('plan'):
+            plan = self.plan(self._iter_sweep_asgs(filter_key, filter_value))
+        self.log.info('planned ASG: %i, to increase: %i', len(plan),
+                      sum(entry['reason'] == REASON_INCREASE for entry in plan))
+        return plan
+
+    def _apply_entry(self, entry: dict, current: AsgRecord):
+        """
+            Applies one plan entry after checking it against the current record
+            of the ASG, so a plan applied twice changes nothing the second time
+        """
+        name = entry['group']
+        if current is None:
+            self.log.warning("Could not find this ASG %s", name)
+            return False
+        desired = current.desired
+        if desired != entry['desired'] or entry['new_desired'] > current.max_size:
+            # already applied, or changed since the plan was made
+            self.log.info("Skipping %s: desired is %s, planned %s -> %s", name, str(desired),
+                          str(entry['desired']), str(entry['new_desired']))
+            return False
+        if self.snapshot_cache is not None:
+            # before the write, a failed or interrupted write leaves the ASG unknown
+            self.snapshot_cache.invalidate(name)
+        try:
+            self.increase_desired_capacity(name, entry['new_desired'])
+        except _api_errors() as error:
+            self.log.warning("Failed to process %s: %s", name, error)
+            return error
+        self.log.info("Desired Capacity of %s has been set to %s.", name,
+                      str(entry['new_desired']))
+        return True
+
+    def apply_plan(self, plan: list, batch_size: int = 50) -> dict:
+        """
+            Applies the entries of a plan which change the desired capacity.
+            The ASG are described again by batches of batch_size names and an entry is
+            only applied while the ASG still has the planned desired capacity.
+            The updates of a batch are spread over max_workers threads.
+
+            Parameters
+            ----------
+            plan : list of dict
+                Plan as returned by plan() or load_plan()
+            batch_size : int
+                Number of ASG described per call, at most 50
+
+            Returns
+            -------
+            results : dict
+                ASG name -> True if applied, False if skipped, or the API error raised
+        """
+        entries = [entry for entry in plan if entry['new_desired'] != entry['desired']]
+        results = {}
+        self.metrics.begin_sweep()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                self.metrics.phase('apply'):
+            for start in range(0, len(entries), batch_size):
+                batch = entries[start:start + batch_size]
+                try:
+                    current = {asg.name: asg for asgs in self._describe_batches(
+                        [entry['group'] for entry in batch], batch_size) for asg in asgs}
+                except _api_errors() as error:
+                    self.log.warning("Failed to describe batch: %s", error)
+                    results.update((entry['group'], error) for entry in batch)
+                    continue
+                outcomes = executor.map(
+                    lambda entry: self._apply_entry(entry, current.get(entry['group'])), batch)
+                results.update(zip((entry['group'] for entry in batch), outcomes))
+        self.metrics.record_results(results)
+        self.metrics.export()
+        return results
+
+    @staticmethod
+    def write_plan(plan: list, path: str) -> None:
+        """
+            Writes a plan as JSON to the given path
+        """
+        with open(path, 'w', encoding='utf-8') as plan_file:
+            json.dump(plan, plan_file, indent=1)
+
+    @staticmethod
+    def load_plan(path: str) -> list:
+        """
+            Reads a plan written by write_plan
+        """
+        with open(path, encoding='utf-8') as plan_file:
+            return json.load(plan_file)
+
+    def run(self, observe=None) -> dict:
+        """
+            Retrieves the names of auto-scaling groups in the current AWS account and region
+            that matches with provided tag filter
+            If ASG's are present, determine the desired and maximum capacity of each ASG.
+            If the desired capacity is less than the maximum capacity and have scaling policy
+            then increase the desired capacity by plus 1.
+            ASG are processed while the remaining pages are still being fetched,
+            or by priority within ASG_TIME_BUDGET seconds when a budget is set.
+
+            Parameters
+            ----------
+            observe : callable
+                Called with every ASG of the sweep, including the ones the journal skips
+
+            Returns
+            -------
+            results : dict
+                ASG name -> True if increased, False if untouched, or the API error raised
+        """
+        filter_key, filter_value = self._start_run()
+        return self.process_sweep(self._iter_sweep_asgs(filter_key, filter_value, observe))
+
+    def _start_run(self) -> tuple:
+        """
+            Starts a run(): returns the (filter_key, filter_value) TAG of the sweep and
+            resets the policy index and the per sweep metrics
+        """
+        # fetching filter tags from container environment variables using static method defined
+        filter_key, filter_value = self.get_filter_tags()
+        self.log.info('Fetched Tag -> key:%s, value:%s', filter_key, filter_value)
+        if self.selector is not None:
+            self.log.info('Selector -> %s', self.selector.text)
+        # policies may have changed since the previous sweep
+        self.clear_policy_index()
+        self.metrics.begin_sweep()
+        return filter_key, filter_value
+
+    def process_sweep(self, asgs, phase: str = 'run') -> dict:
+        """
+            Processes the given ASG as one sweep: the journal and the decision report
+            are begun and finished around it, the ASG go through the scheduler when one
+            is configured, and the snapshot cache and the metrics are saved afterwards
+
+            Parameters
+            ----------
+            asgs : iterable of AsgRecord
+                ASG of the sweep, e.g. from _iter_sweep_asgs()
+            phase : str
+                Metrics phase the sweep is timed under
+
+            Returns
+            -------
+            results : dict
+                ASG name -> True if increased, False if untouched, or the API error raised
+        """
+        self._begin_sweep()
+        with self.metrics.phase(phase):
+            if self.scheduler is not None:
+                asgs = self.scheduler.schedule(asgs)
+            results = self.process_asgs(asgs)
+            if self.snapshot_cache is not None:
+                with self.metrics.phase('cache_save'):
+                    self.snapshot_cache.save()
+        return self._end_sweep(results)
+
+    def _begin_sweep(self) -> None:
+        """
+            Starts the scheduler budget, the journal and the decision report of a sweep
+        """
+        if self.scheduler is not None:
+            # asgs is consumed lazily, so listing the ASG counts against the budget
+            self.scheduler.start()
+        if self.journal is not None:
+            resumed = self.journal.begin()
+            if resumed:
+                self.log.info('Resuming interrupted sweep, %i ASG already handled', resumed)
+        if self.decision_report is not None:
+            self.decision_report.begin()
+
+    def _end_sweep(self, results: dict) -> dict:
+        """
+            Records the results of a sweep in the scheduler, the journal, the decision
+            report and the metrics, and returns them
+        """
+        skipped = len(self.scheduler.skipped) if self.scheduler is not None else 0
+        if self.scheduler is not None:
+            self.scheduler.record(results)
+        # a sweep cut by its time budget is resumed by the next run
+        if self.journal is not None and not skipped:
+            self.journal.finish()
+        if self.decision_report is not None:
+            self.decision_report.close()
+        self.metrics.record_results(results, skipped)
+        self.metrics.export()
+        self.log.info('total fetched ASG: %i', len(results))
+        self.log.info('total increased ASG: %i',
+                      sum(outcome is True for outcome in results.values()))
+        return results
+
+
+def _observed(asgs, observe):
+    """
+        Passes the ASG through, calling observe with each of them
     """
-    def __init__(self, asg_client=None) -> None:
-        # Modifying the default retries behaviour {mode: standard->adaptive} (max_attempts: 5->10)
-        config = boto3.session.Config(retries={"max_attempts": 10, "mode": "adaptive"})
-        session = boto3.session.Session()  # initializing the boto3 session
-        self.log = logging.getLogger('Asgcount')
-        self.log.setLevel(os.getenv("LOG_LEVEL", "INFO"))
-        try:
-            # initializing the ASG session
-            if not asg_client:
-                self._asg = session.client("autoscaling", config=config)
-                self.log.info('session initiated')
-            else:
-                self._asg = asg_client
-        except ClientError as error:
-            logging.warning(error)
+    for asg in asgs:
+        observe(asg)
+        yield asg
 
-    def check_scaling_policy(self, name: str) -> bool:
+
+class _ThreadedAsyncClient:
+    """
+        Exposes the methods of a blocking boto3 client as coroutines
+        by running every call in the event loop default executor
+    """
+    def __init__(self, client) -> None:
+        self._client = client
+        # the event system of the blocking client, for the metrics and rate limiter hooks
+        self.meta = getattr(client, 'meta', None)
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+
+        async def call(**kwargs):
+            import asyncio
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(method, **kwargs))
+        return call
+
+
+class AsyncAsgCount:
+    """
+        Asyncio counterpart of AsgCount for increasing ASG desired_count to +1
+        The client is expected to expose describe_auto_scaling_groups, describe_policies
+        and set_desired_capacity as coroutines (e.g. an aiobotocore client),
+        when none is given a default boto3 client is driven from the default executor.
+        The configuration, the decisions, the journal, the decision report, the scheduler
+        and the metrics are the ones of the AsgCount in asg_count, only the API calls
+        are awaited here. The ASG are always listed from the API, a snapshot cache is
+        kept up to date but not read.
+    """
+    def __init__(self, asg_client=None, max_concurrency: int = None, **kwargs) -> None:
+        # number of ASG processed at the same time by run()
+        self.max_concurrency = max(
+            int(max_concurrency or os.getenv("ASG_MAX_CONCURRENCY", "10")), 1)
+        if not asg_client:
+            # a client of its own, the metrics hooks must not see other instances' calls
+            asg_client = _ThreadedAsyncClient(
+                _default_client(max(self.max_concurrency, 10), shared=False))
+        # kwargs are the AsgCount arguments, e.g. use_policy_index, page_size or journal
+        self.asg_count = AsgCount(asg_client=asg_client, max_workers=self.max_concurrency,
+                                  **kwargs)
+        self.log = self.asg_count.log
+        self._asg = asg_client
+
+    async def check_scaling_policy(self, name: str) -> bool:
         """
             Used to check whether the given ASG has dynamic scaling policies or not
-            Expects one parameter name of an ASG
-
+            When a policy index has been built it is a set lookup, no API call is made
 
             Parameters
             ----------
@@ -44,14 +2250,52 @@ class AsgCount:
             - bool
                 The return value is True for success scenario, False otherwise.
         """
-        response = self._asg.describe_policies(
-            AutoScalingGroupName=name)
-        scaling_policy = response.get('ScalingPolicies', None)
-        return bool(scaling_policy)
+        if self.asg_count._policy_index is not None:
+            return name in self.asg_count._policy_index
+        response = await self._asg.describe_policies(AutoScalingGroupName=name)
+        return bool(response.get('ScalingPolicies', None))
 
-    def get_names_filtered(self, key: str, value: str) -> list:
+    async def build_policy_index(self) -> set:
         """
-            Returns the list of all the asg names
+            Pages through describe_policies once for the whole account and
+            builds the set of ASG names having at least one scaling policy.
+
+            Returns
+            -------
+            policy_index : set of str
+                Names of the ASG having scaling policies
+        """
+        policy_index = set()
+        kwargs = {}
+        with self.asg_count.metrics.phase('policy_index'):
+            while True:
+                response = await self._asg.describe_policies(**kwargs)
+                policy_index.update(policy['AutoScalingGroupName']
+                                    for policy in response.get('ScalingPolicies', []))
+                if not response.get('NextToken'):
+                    break
+                kwargs['NextToken'] = response['NextToken']
+        self.asg_count._policy_index = policy_index
+        return policy_index
+
+    async def _paginate_asgs(self, **kwargs):
+        """
+            Pages through describe_auto_scaling_groups and yields every record,
+            kwargs are passed to the call
+        """
+        kwargs['MaxRecords'] = self.asg_count.page_size
+        while True:
+            response = await self._asg.describe_auto_scaling_groups(**kwargs)
+            for group in response.get('AutoScalingGroups', []):
+                yield AsgRecord.from_group(group)
+            if not response.get('NextToken'):
+                break
+            kwargs['NextToken'] = response['NextToken']
+
+    async def iter_asgs_filtered(self, key: str, value: str):
+        """
+            Yields the describe records of the asg matched with provided key:value TAG
+            page by page, using the server side tag filter of asg_count
 
             Parameters
             ----------
@@ -60,128 +2304,600 @@ class AsgCount:
             value : str
                 Value of ASG_TAG
 
-            Returns
-            -------
-            asg_name_list : list of str
-                List of ASG matched with provided key:value TAG
+            Yields
+            ------
+            asg : AsgRecord
+                ASG record projected from describe_auto_scaling_groups
         """
+        asg_count = self.asg_count
+        kwargs = asg_count._server_filter_kwargs(key, value)
+        while kwargs is not None:
+            yielded = False
+            try:
+                async for asg in self._paginate_asgs(**kwargs):
+                    if (key, value) in asg.tags:
+                        yielded = True
+                        yield asg
+                return
+            except _api_errors() as error:
+                asg_count._server_filter_failed(error, yielded)
+            kwargs = asg_count._server_filter_kwargs(key, value)
+        async for asg in self._paginate_asgs():
+            if (key, value) in asg.tags:
+                yield asg
 
-        # Pagination to avoid long page issue
-        paginator = self._asg.get_paginator('describe_auto_scaling_groups')
-        iterator = paginator.paginate(PaginationConfig={'MaxItems': 100000})
-        # JMESPath filter using given key:value under Tags
-        filtered_asgs = iterator.search(
-            'AutoScalingGroups[] | [?contains(Tags[?Key==`{}`].Value, `{}`)]'.format(
-                key, value)
-        )
-        asg_name_list = []
-        for asg in filtered_asgs:
-            asg_name_list.append(asg['AutoScalingGroupName'])
-        self.log.debug("Total number of Asg's are = %s", str(len(asg_name_list)))
-        return asg_name_list
+    async def _iter_sweep_asgs(self, key: str, value: str):
+        """
+            Yields the ASG of a sweep like AsgCount._iter_sweep_asgs(), matched by the
+            selector or the key:value TAG, in the shard of this worker and not yet handled
+            according to the journal, and builds the policy index before the first ASG
+            below maximum capacity
+        """
+        asg_count = self.asg_count
+        if asg_count.selector is not None:
+            required = asg_count.selector.required_tag()
+            asgs = self.iter_asgs_filtered(*required) if required is not None \
+                else self._paginate_asgs(IncludeInstances=False)
+        else:
+            asgs = self.iter_asgs_filtered(key=key, value=value)
+        async for asg in asgs:
+            if not asg_count.in_sweep(asg):
+                continue
+            if asg_count.journal is not None and asg_count.journal.handled(asg):
+                # ASG handled before the sweep was interrupted
+                continue
+            if asg_count.use_policy_index and asg_count._policy_index is None \
+                    and asg.desired < asg.max_size:
+                # one account-wide describe_policies pass instead of one call per ASG
+                await self.build_policy_index()
+            yield asg
 
-    def get_asg_desired_max_capacity(self, asg_name: str) -> tuple:
+    async def increase_desired_capacity(self, name: str, new_count: int) -> None:
         """
-            Returns the desired and maximum capacity of provided asg_name.
+            Sets the desired capacity of the ASG to new_count
 
             Parameters
             ----------
-            asg_name : str
+            name : str
                 Name of the ASG
+            new_count : int
+                New desired capacity
+        """
+        await self._asg.set_desired_capacity(
+            AutoScalingGroupName=name,
+            DesiredCapacity=new_count,
+            HonorCooldown=False
+        )
+
+    async def process_asg(self, asg: AsgRecord) -> bool:
+        """
+            Applies the +1 decision to one ASG using its paginated describe record
+
+            Parameters
+            ----------
+            asg : AsgRecord
+                ASG record, a describe_auto_scaling_groups document is projected first
 
             Returns
             -------
-            tuple containing int (desired_cap, max_cap)
-            - desired_cap : int
-                desired capacity of the provided ASG
-            - max_cap : int
-                maximum capacity of the provided ASG
+            - bool
+                True if the desired capacity has been increased, False otherwise.
         """
-        response = self._asg.describe_auto_scaling_groups(
-            AutoScalingGroupNames=[
-                asg_name,
-            ])
-        details = response.get('AutoScalingGroups', None)
-        if not details:
-            self.log.warning("Could not find this ASG %s", asg_name)
-            return -1, -1
+        return (await self._process(AsgRecord.of(asg)))[1] == REASON_INCREASE
+
+    async def _process(self, asg: AsgRecord) -> tuple:
+        """
+            Takes the decision of AsgCount.decide() and applies it, returns
+            (new_desired, reason)
+        """
+        asg_count = self.asg_count
+        name = asg.name
+        self.log.info('The ASG: %s', name)
+        # the policy is only looked up for ASG below their maximum
+        policy = await self.check_scaling_policy(name) if asg.desired < asg.max_size else None
+        new_desired, reason = asg_count._decision(asg, policy)
+        if asg_count._before_write(name, new_desired, reason):
+            await self.increase_desired_capacity(name, new_desired)
+            asg_count._after_write(name)
+        return new_desired, reason
+
+    async def _process_asg_safe(self, asg: AsgRecord, semaphore, results: dict):
+        """
+            Runs process_asg, stores the outcome or the API error raised in results
+            and releases the semaphore slot acquired by run()
+        """
+        start = time.perf_counter()
+        try:
+            new_desired, reason = await self._process(asg)
+        except _api_errors() as error:
+            results[asg.name] = self.asg_count._failed(asg, error, start)
         else:
-            desired_cap, max_cap = int(details[0]['DesiredCapacity']), int(details[0]['MaxSize'])
-            self.log.info("%s Desired=%s Maximum=%s", asg_name, str(desired_cap), str(max_cap))
-            return desired_cap, max_cap
+            results[asg.name] = self.asg_count._processed(asg, new_desired, reason, start)
+        finally:
+            semaphore.release()
 
-    def increase_desired_capacity(self, name: str, new_count: int) -> None:
+    async def _submit(self, asg: AsgRecord, semaphore, results: dict, tasks: set) -> None:
         """
-            It takes two parameter ASG name and
-            new desired count value for increasing the ASG to desired value.
-            It doesn't return anything,
+            Starts processing the ASG once a semaphore slot is free
+        """
+        import asyncio
+        # waits for a free slot, so pagination is paced by the processing
+        await semaphore.acquire()
+        task = asyncio.ensure_future(self._process_asg_safe(asg, semaphore, results))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
 
-            Parameters
-            ----------
-            name : str
-                Name of the ASG
-            new_count : int
-                New desired capacity
+    async def run(self) -> dict:
+        """
+            Coroutine version of AsgCount.run(), ASG are processed by at most
+            max_concurrency coroutines while the remaining pages are being fetched,
+            or by priority once listed when asg_count has a scheduler
 
             Returns
             -------
-            None
+            results : dict
+                ASG name -> True if increased, False if untouched, or the API error raised
         """
-        self._asg.set_desired_capacity(
-            AutoScalingGroupName=name,
-            DesiredCapacity=new_count,
-            HonorCooldown=False
-        )
+        import asyncio
+        asg_count = self.asg_count
+        filter_key, filter_value = asg_count._start_run()
+        asg_count._begin_sweep()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = {}
+        tasks = set()
+        with asg_count.metrics.phase('run'):
+            asgs = self._iter_sweep_asgs(filter_key, filter_value)
+            if asg_count.scheduler is not None:
+                # the priorities are only known once every ASG has been listed
+                for asg in asg_count.scheduler.schedule([asg async for asg in asgs]):
+                    await self._submit(asg, semaphore, results, tasks)
+            else:
+                async for asg in asgs:
+                    await self._submit(asg, semaphore, results, tasks)
+            if tasks:
+                await asyncio.gather(*tasks)
+            if asg_count.snapshot_cache is not None:
+                with asg_count.metrics.phase('cache_save'):
+                    asg_count.snapshot_cache.save()
+        return asg_count._end_sweep(results)
 
-    @staticmethod
-    def get_filter_tags() -> tuple:
+
+# CloudTrail events changing the scaling policies of an ASG
+_POLICY_EVENTS = {'PutScalingPolicy', 'DeletePolicy'}
+
+
+def event_groups(event: dict) -> tuple:
+    """
+        Returns the ASG names an EventBridge style event is about, from Auto Scaling
+        notifications (detail.AutoScalingGroupName) and from CloudTrail API calls
+        (detail.requestParameters.autoScalingGroupName and tag resources)
+
+        Returns
+        -------
+        tuple (names, policy_changed)
+        - names : set of str
+            Names of the ASG whose state may have changed
+        - policy_changed : bool
+            True if the scaling policies of the ASG changed
+    """
+    detail = event.get('detail') or {}
+    parameters = detail.get('requestParameters') or {}
+    names = {detail.get('AutoScalingGroupName'), parameters.get('autoScalingGroupName')}
+    names.update(tag.get('resourceId') for tag in parameters.get('tags') or ()
+                 if tag.get('resourceType', 'auto-scaling-group') == 'auto-scaling-group')
+    names.discard(None)
+    return names, detail.get('eventName') in _POLICY_EVENTS
+
+
+class FileEventSource:
+    """
+        Event source reading one JSON event per line appended to a file,
+        only the lines added since the previous poll are returned
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.offset = 0
+
+    def poll(self) -> list:
         """
-            Return the filter key and filter value by
-             fetching from container environment variables
-             takes no argumentcmd
+            Returns the events appended since the previous poll, a partially
+            written last line is left for the next poll
+        """
+        try:
+            with open(self.path, 'rb') as events_file:
+                events_file.seek(0, os.SEEK_END)
+                if events_file.tell() < self.offset:
+                    # truncated or rotated, read it again from the start
+                    self.offset = 0
+                events_file.seek(self.offset)
+                data = events_file.read()
+        except OSError:
+            return []
+        complete = data.rfind(b'\n') + 1
+        self.offset += complete
+        events = []
+        for line in data[:complete].splitlines():
+            try:
+                if line.strip():
+                    events.append(json.loads(line))
+            except ValueError:
+                logging.getLogger('Asgcount').warning('Skipping invalid event %r', line[:200])
+        return events
+
+
+class DirectoryEventSource:
+    """
+        Event source consuming a directory queue, every *.json file holds one event or
+        a list of events and is removed once read. Writers are expected to create the
+        files under another name and rename them, so no file is read half written.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def poll(self) -> list:
+        """
+            Returns the events of the queued files, oldest file name first
+        """
+        try:
+            names = sorted(name for name in os.listdir(self.path) if name.endswith('.json'))
+        except OSError:
+            return []
+        events = []
+        for name in names:
+            path = os.path.join(self.path, name)
+            try:
+                with open(path, encoding='utf-8') as event_file:
+                    loaded = json.load(event_file)
+            except ValueError:
+                # kept aside for inspection instead of being retried forever
+                logging.getLogger('Asgcount').warning('Skipping invalid event file %s', name)
+                os.replace(path, '{}.invalid'.format(path))
+                continue
+            except OSError:
+                continue
+            events.extend(loaded if isinstance(loaded, list) else [loaded])
+            os.remove(path)
+        return events
+
+
+def event_source(path: str):
+    """
+        Returns the event source of a path, a DirectoryEventSource for a directory
+        and a FileEventSource otherwise
+    """
+    return DirectoryEventSource(path) if os.path.isdir(path) else FileEventSource(path)
+
+
+class AsgIncrementalSweep:
+    """
+        Event driven sweep keeping an in-memory model of the ASG matched by the sweep.
+        The first cycle is a full sweep which builds the model and the policy index,
+        the next cycles only describe the ASG named by the events of the source and
+        process those whose capacities or tags differ from the model, so the API cost
+        of a cycle follows the churn of the fleet rather than its size.
+        Increases made by the sweep itself update the model, so their own change
+        events do not trigger another increase.
+    """
+    def __init__(self, asg_count: AsgCount, source, resync: float = None) -> None:
+        """
+            Parameters
+            ----------
+            asg_count : AsgCount
+                Used for the describe, policy and set_desired_capacity calls
+            source : FileEventSource, DirectoryEventSource
+                Any object whose poll() returns the new EventBridge style events
+            resync : float
+                Seconds after which a full sweep is made again, in case events were lost,
+                defaults to ASG_EVENT_RESYNC or one hour
+        """
+        self.asg_count = asg_count
+        self.source = source
+        self.resync = float(resync if resync is not None else
+                            os.getenv('ASG_EVENT_RESYNC', '3600'))
+        # ASG name -> AsgRecord, None until the first full sweep
+        self.records = None
+        self.synced_at = 0.0
+
+    def cycle(self) -> dict:
+        """
+            Runs one cycle, a full sweep when the model is missing or too old
 
             Returns
             -------
-            tuple containing str (filter_key, filter_value)
-            - filter_key : str
-                Tag name used to filter the ASG
-            - filter_value : str
-                Tag value used to filter the ASG
+            results : dict
+                ASG name -> True if increased, False if untouched, or the API error raised
         """
-        filter_key = os.getenv('ASG_TAG_NAME')
-        filter_value = os.getenv('ASG_TAG_VALUE')
-        return filter_key, filter_value
+        if self.records is None or time.monotonic() - self.synced_at >= self.resync:
+            return self._full_cycle()
+        names, policy_names = set(), set()
+        for event in self.source.poll():
+            event_names, policy_changed = event_groups(event)
+            names |= event_names
+            if policy_changed:
+                policy_names |= event_names
+        if not names:
+            return {}
+        asg_count = self.asg_count
+        asg_count.metrics.begin_sweep()
+        with asg_count.metrics.phase('events'):
+            self._refresh_policies(policy_names)
+            described = {asg.name: asg for batch in asg_count._describe_batches(sorted(names))
+                         for asg in batch}
+            changed = []
+            for name in sorted(names):
+                asg = described.get(name)
+                if asg is None or not asg_count.in_sweep(asg):
+                    # deleted, untagged or out of the shard
+                    self.records.pop(name, None)
+                elif self.records.get(name) != asg or name in policy_names:
+                    self.records[name] = asg
+                    changed.append(asg)
+        results = asg_count.process_sweep(changed, phase='events')
+        self._update_model(results)
+        asg_count.log.info('events: %i ASG named, %i changed, %i increased', len(names),
+                           len(changed), sum(outcome is True for outcome in results.values()))
+        return results
 
-    def run(self) -> None:
+    def _full_cycle(self) -> dict:
         """
-            Retrieves the names of auto-scaling groups in the current AWS account and region
-            that matches with provided tag filter
-            If ASG's are present, determine the desired and maximum capacity of each ASG.
-            If the desired capacity is less than the maximum capacity and have scaling policy
-            then increase the desired capacity by plus 1.
+            Runs a full sweep, recording every swept ASG in a new model
         """
-        # fetching filter tags from container environment variables using static method defined
-        filter_key, filter_value = self.get_filter_tags()
-        self.log.info('Fetched Tag -> key:%s, value:%s', filter_key, filter_value)
-        # retrieve ASG with only matched key:value
-        asg_names = self.get_names_filtered(key=filter_key, value=filter_value)
-        self.log.info('total fetched ASG: %i', len(asg_names))
-        if len(asg_names) > 0:  # If only any match found
-            for name in asg_names:
-                # get desired and max capacity
-                self.log.info('The ASG: %s', name)
-                desired, max_cap = self.get_asg_desired_max_capacity(name)
-                if desired < max_cap:  # if we can increase
-                    if self.check_scaling_policy(name):
-                        # increase desired to +1
-                        self.increase_desired_capacity(name,desired+1)
-                        self.log.info("Desired Capacity of %s has been increased by 1.", name)
-                    else:
-                        self.log.info("Scaling policy not exist for %s", name)
+        asg_count = self.asg_count
+        # the full sweep covers whatever happened before it
+        self.source.poll()
+        records = {}
+
+        def record(asg: AsgRecord) -> None:
+            records[asg.name] = asg
+        results = asg_count.run(observe=record)
+        self.records = records
+        self.synced_at = time.monotonic()
+        self._update_model(results)
+        asg_count.log.info('full sweep: %i ASG in the model', len(records))
+        return results
+
+    def _refresh_policies(self, names: set) -> None:
+        """
+            Updates the policy index for the ASG whose scaling policies changed
+        """
+        policy_index = self.asg_count._policy_index
+        if policy_index is None:
+            # without index every check already describes the policies of the ASG
+            return
+        for name in names:
+            response = self.asg_count._asg.describe_policies(AutoScalingGroupName=name)
+            if response.get('ScalingPolicies'):
+                policy_index.add(name)
+            else:
+                policy_index.discard(name)
+
+    def _update_model(self, results: dict) -> None:
+        """
+            Applies the increases of a cycle to the model
+        """
+        for name, outcome in results.items():
+            asg = self.records.get(name)
+            if outcome is True and asg is not None:
+                self.records[name] = AsgRecord(asg.name, asg.desired + 1, asg.min_size,
+                                               asg.max_size, asg.tags)
+
+
+# AsgCount per (region, role_arn) target, kept for the lifetime of a worker process
+_TARGET_ASG_COUNTS = {}
+
+
+def get_targets() -> list:
+    """
+        Return the (region, role_arn) targets by fetching the comma separated
+        ASG_REGIONS and ASG_ROLE_ARNS container environment variables.
+        An empty ASG_ROLE_ARNS means the credentials of the container itself,
+        an empty ASG_REGIONS means the default region.
+
+        Returns
+        -------
+        targets : list of tuple (region, role_arn)
+            Every region combined with every role, None for the defaults
+    """
+    regions = [region.strip() for region in os.getenv('ASG_REGIONS', '').split(',')
+               if region.strip()] or [None]
+    role_arns = [role.strip() for role in os.getenv('ASG_ROLE_ARNS', '').split(',')
+                 if role.strip()] or [None]
+    return list(itertools.product(regions, role_arns))
+
+
+def _target_asg_count(region: str, role_arn: str) -> AsgCount:
+    """
+        Returns the AsgCount of the given target, creating its session and client once
+        per worker process, and again only when the assumed role credentials expire
+    """
+    asg_count, expiration = _TARGET_ASG_COUNTS.get((region, role_arn), (None, None))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if asg_count is None or (expiration and expiration - now < datetime.timedelta(minutes=5)):
+        import boto3
+        session = boto3.session.Session(region_name=region)
+        if role_arn:
+            credentials = session.client('sts').assume_role(
+                RoleArn=role_arn, RoleSessionName='AsgCount')['Credentials']
+            session = boto3.session.Session(
+                aws_access_key_id=credentials['AccessKeyId'],
+                aws_secret_access_key=credentials['SecretAccessKey'],
+                aws_session_token=credentials['SessionToken'],
+                region_name=region)
+            expiration = credentials['Expiration']
+        asg_count = AsgCount(session=session, target=(region, role_arn))
+        _TARGET_ASG_COUNTS[(region, role_arn)] = (asg_count, expiration)
+    return asg_count
+
+
+def _init_worker(rate_limiter: AsgRateLimiter) -> None:
+    """
+        Process pool initializer installing the rate limiter shared by every worker
+    """
+    global _SHARED_RATE_LIMITER
+    _SHARED_RATE_LIMITER = rate_limiter
+
+
+def _target_executor(processes: int):
+    """
+        Returns a process pool for the targets, its workers share one rate limiter
+        when ASG_RATE_LIMITS is set so together they stay within the account budget
+    """
+    # multiprocessing is only loaded for multi-target runs
+    from concurrent.futures import ProcessPoolExecutor
+    rate_limiter = AsgRateLimiter.from_env(shared=True)
+    if rate_limiter is None:
+        return ProcessPoolExecutor(max_workers=processes)
+    return ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                               initargs=(rate_limiter,))
+
+
+def _run_target(target: tuple) -> dict:
+    """
+        Runs one sweep for a (region, role_arn) target and returns a picklable summary
+    """
+    region, role_arn = target
+    summary = {'region': region, 'role_arn': role_arn,
+               'increased': [], 'untouched': 0, 'errors': {}}
+    try:
+        results = _target_asg_count(region, role_arn).run()
+    except _api_errors() as error:
+        logging.warning("Sweep failed for %s %s: %s", region, role_arn, error)
+        summary['errors']['*'] = str(error)
+        return summary
+    for name, outcome in results.items():
+        if outcome is True:
+            summary['increased'].append(name)
+        elif outcome is False:
+            summary['untouched'] += 1
+        else:
+            summary['errors'][name] = str(outcome)
+    return summary
+
+
+def run_targets(targets: list, processes: int = None, executor=None) -> dict:
+    """
+        Runs one sweep per (region, role_arn) target, each target in a worker
+        process of its own, and merges the per target summaries.
+
+        Parameters
+        ----------
+        targets : list of tuple (region, role_arn)
+            Targets as returned by get_targets()
+        processes : int
+            Size of the process pool, defaults to ASG_PROCESSES or the number of cores.
+            With 1 the targets are swept one after another in the current process.
+        executor : concurrent.futures.Executor
+            Pool kept by the caller across calls, so the worker processes and their
+            clients stay warm, processes is ignored when given
+
+        Returns
+        -------
+        summary : dict
+            'targets' with the summary of each target and the merged
+            'increased', 'untouched' and 'errors' counts
+    """
+    processes = int(processes or os.getenv('ASG_PROCESSES', '0')) or os.cpu_count() or 1
+    processes = min(processes, len(targets))
+    if executor is not None:
+        summaries = list(executor.map(_run_target, targets))
+    elif processes <= 1:
+        summaries = [_run_target(target) for target in targets]
+    else:
+        with _target_executor(processes) as executor:
+            summaries = list(executor.map(_run_target, targets))
+    return {
+        'targets': summaries,
+        'increased': sum(len(summary['increased']) for summary in summaries),
+        'untouched': sum(summary['untouched'] for summary in summaries),
+        'errors': sum(len(summary['errors']) for summary in summaries),
+    }
+
+
+def run_daemon(sweep, interval: float, jitter: float = 0.1, stop_event=None,
+               max_cycles: int = None) -> int:
+    """
+        Calls sweep every interval seconds until stop_event is set, keeping whatever
+        sweep holds (session, clients, connection pools, worker processes) alive
+        between cycles. A sweep in progress is always completed before returning.
+
+        Parameters
+        ----------
+        sweep : callable
+            Runs one sweep, e.g. AsgCount().run
+        interval : float
+            Seconds between the start of two sweeps
+        jitter : float
+            Fraction of the interval randomly added to or removed from each wait,
+            so many daemons started together do not call the API in step
+        stop_event : threading.Event
+            Set to stop the loop, e.g. from a SIGTERM handler
+        max_cycles : int
+            Stops after this number of sweeps, runs forever when None
+
+        Returns
+        -------
+        cycles : int
+            Number of sweeps run
+    """
+    stop_event = stop_event or threading.Event()
+    log = logging.getLogger('Asgcount')
+    cycles = 0
+    while not stop_event.is_set():
+        start = time.monotonic()
+        try:
+            sweep()
+        except _api_errors() as error:
+            log.warning("Sweep failed: %s", error)
+        cycles += 1
+        if max_cycles is not None and cycles >= max_cycles:
+            break
+        delay = interval - (time.monotonic() - start) + random.uniform(-jitter, jitter) * interval
+        stop_event.wait(max(delay, 0))
+    log.info('Daemon stopped after %i sweeps', cycles)
+    return cycles
+
+
+def _stop_on_signals() -> threading.Event:
+    """
+        Returns an event set on SIGTERM or SIGINT, for a graceful shutdown
+    """
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_args: stop_event.set())
+    return stop_event
 
 
 def _main() -> None:
-    AsgCount().run()
+    targets = get_targets()
+    interval = float(os.getenv('ASG_DAEMON_INTERVAL', '0'))
+    jitter = float(os.getenv('ASG_DAEMON_JITTER', '0.1'))
+    if os.getenv('ASG_APPLY_PLAN'):
+        # apply a plan made by an earlier dry run
+        asg_count = AsgCount()
+        asg_count.apply_plan(asg_count.load_plan(os.getenv('ASG_APPLY_PLAN')))
+    elif os.getenv('ASG_DRY_RUN', 'false').lower() == 'true':
+        asg_count = AsgCount()
+        asg_count.write_plan(asg_count.plan_sweep(), os.getenv('ASG_PLAN_PATH', 'asg_plan.json'))
+    elif os.getenv('ASG_EVENT_SOURCE'):
+        # incremental mode, the first cycle is a full sweep and then only changed ASG
+        incremental = AsgIncrementalSweep(AsgCount(), event_source(os.getenv('ASG_EVENT_SOURCE')))
+        run_daemon(incremental.cycle, interval or 10, jitter, _stop_on_signals())
+    elif interval > 0 and targets == [(None, None)]:
+        # daemon mode, the AsgCount and its client are reused by every sweep
+        run_daemon(AsgCount().run, interval, jitter, _stop_on_signals())
+    elif interval > 0:
+        processes = min(int(os.getenv('ASG_PROCESSES', '0')) or os.cpu_count() or 1,
+                        len(targets))
+        stop_event = _stop_on_signals()
+        with _target_executor(processes) as executor:
+            run_daemon(functools.partial(run_targets, targets, executor=executor),
+                       interval, jitter, stop_event)
+    elif targets == [(None, None)]:
+        AsgCount().run()
+    else:
+        summary = run_targets(targets)
+        logging.info('Swept %i targets: increased=%i untouched=%i errors=%i', len(targets),
+                     summary['increased'], summary['untouched'], summary['errors'])
 
 
 if __name__ == "__main__":
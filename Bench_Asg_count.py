@@ -0,0 +1,783 @@
+"""
+    Offline benchmark of the AsgCount sweep modes against a simulated Auto Scaling service,
+    or against a cassette of API calls recorded from a real account and replayed.
+"""
+import argparse
+import asyncio
+import collections
+import gzip
+import hashlib
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import jmespath
+from botocore.exceptions import ClientError
+from botocore.hooks import HierarchicalEmitter
+from Asg_count import AsgCount, AsgIncrementalSweep, AsgMetrics, AsyncAsgCount, \
+    DirectoryEventSource, _ThreadedAsyncClient
+
+BENCH_TAG_KEY = 'Bench_key'
+BENCH_TAG_VALUE = 'Bench_value'
+# modes a cassette of a sweep can serve, 'legacy' describes every ASG on its own
+# and 'incremental' changes the fleet between its cycles
+CASSETTE_MODES = ('sweep', 'threaded', 'async', 'sharded')
+
+# measured in a fresh interpreter by measure_startup()
+_STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import Asg_count
+imported = time.perf_counter()
+Asg_count.AsgCount(asg_client=object())
+injected = time.perf_counter()
+heavy_modules = sorted({'boto3', 'botocore', 'asyncio'} & set(sys.modules))
+Asg_count.AsgCount()
+default = time.perf_counter()
+Asg_count.AsgCount()
+reused = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000,
+                  'injected_startup_ms': (injected - imported) * 1000,
+                  'heavy_modules': heavy_modules,
+                  'default_startup_ms': (default - injected) * 1000,
+                  'reused_startup_ms': (reused - default) * 1000}))
+"""
+
+
+def make_fleet(count: int, match_ratio: float = 0.05, policy_ratio: float = 0.8,
+               instances: int = 2, seed: int = 0) -> tuple:
+    """
+        Builds a fleet of describe_auto_scaling_groups records
+
+        Parameters
+        ----------
+        count : int
+            Number of ASG in the account
+        match_ratio : float
+            Share of the ASG carrying the BENCH_TAG_KEY:BENCH_TAG_VALUE tag
+        policy_ratio : float
+            Share of the ASG having a scaling policy
+        instances : int
+            Number of instances listed in every ASG, drives the payload size
+        seed : int
+            Seed of the random generator, the same seed gives the same fleet
+
+        Returns
+        -------
+        tuple (groups, policies)
+        - groups : list of dict
+            ASG records in describe_auto_scaling_groups shape
+        - policies : list of dict
+            Scaling policies in describe_policies shape
+    """
+    rand = random.Random(seed)
+    groups, policies = [], []
+    for index in range(count):
+        name = 'bench-asg-{:06d}'.format(index)
+        max_cap = rand.randint(1, 10)
+        tags = [{'ResourceId': name, 'ResourceType': 'auto-scaling-group',
+                 'Key': 'Name', 'Value': name, 'PropagateAtLaunch': True}]
+        if rand.random() < match_ratio:
+            tags.append({'ResourceId': name, 'ResourceType': 'auto-scaling-group',
+                         'Key': BENCH_TAG_KEY, 'Value': BENCH_TAG_VALUE,
+                         'PropagateAtLaunch': True})
+        groups.append({
+            'AutoScalingGroupName': name,
+            'AutoScalingGroupARN': 'arn:aws:autoscaling:us-west-2:000000000000:'
+                                   'autoScalingGroup:{}'.format(name),
+            'LaunchTemplate': {'LaunchTemplateId': 'lt-0f85ff6b7c4b26d7c',
+                               'LaunchTemplateName': 'Bench_LaunchTemplate', 'Version': '1'},
+            'MinSize': 0,
+            'MaxSize': max_cap,
+            'DesiredCapacity': rand.randint(0, max_cap),
+            'DefaultCooldown': 300,
+            'AvailabilityZones': ['us-west-2a', 'us-west-2b'],
+            'HealthCheckType': 'EC2',
+            'Instances': [{'InstanceId': 'i-{:08x}{:04x}'.format(index, instance),
+                           'InstanceType': 'm5.large', 'AvailabilityZone': 'us-west-2a',
+                           'LifecycleState': 'InService', 'HealthStatus': 'Healthy',
+                           'ProtectedFromScaleIn': False}
+                          for instance in range(instances)],
+            'SuspendedProcesses': [],
+            'VPCZoneIdentifier': 'subnet-bench',
+            'Tags': tags,
+        })
+        if rand.random() < policy_ratio:
+            policies.append({'AutoScalingGroupName': name,
+                             'PolicyName': '{}-CPUReservation'.format(name),
+                             'PolicyType': 'TargetTrackingScaling', 'Enabled': True})
+    return groups, policies
+
+
+class FakePageIterator:
+    """
+        Iterable of response pages with the search() method of a botocore PageIterator
+    """
+    def __init__(self, client, operation: str, kwargs: dict, page_size: int) -> None:
+        self._client = client
+        self._operation = operation
+        self._kwargs = kwargs
+        self._page_size = page_size
+
+    def __iter__(self):
+        kwargs = dict(self._kwargs, MaxRecords=self._page_size)
+        while True:
+            page = getattr(self._client, self._operation)(**kwargs)
+            yield page
+            if not page.get('NextToken'):
+                return
+            kwargs['NextToken'] = page['NextToken']
+
+    def search(self, expression: str):
+        """
+            Yields the JMESPath expression results of every page, flattening lists
+        """
+        compiled = jmespath.compile(expression)
+        for page in self:
+            results = compiled.search(page)
+            if isinstance(results, list):
+                yield from results
+            elif results is not None:
+                yield results
+
+
+class FakePaginator:
+    """
+        Paginator returned by FakeAutoScalingClient.get_paginator
+    """
+    def __init__(self, client, operation: str) -> None:
+        self._client = client
+        self._operation = operation
+
+    def paginate(self, PaginationConfig: dict = None, **kwargs) -> FakePageIterator:
+        """
+            Returns the page iterator, only PageSize of PaginationConfig is honoured
+        """
+        page_size = (PaginationConfig or {}).get('PageSize') or 50
+        return FakePageIterator(self._client, self._operation, kwargs, page_size)
+
+
+class FakeAutoScalingClient:
+    """
+        In-memory stand-in of the boto3 autoscaling client used by AsgCount.
+        Serves real NextToken pagination and tag filters, sleeps latency seconds
+        per call and answers with a Throttling error at throttle_rate, retried
+        like the adaptive retry mode up to max_attempts before it is raised.
+        Emits the before-call, needs-retry and after-call events of a botocore
+        client on meta.events, so client hooks work against it. Every response goes
+        through a JSON round trip, so callers get freshly parsed documents like
+        from a real client.
+    """
+    def __init__(self, groups: list, policies: list, latency: float = 0.0,
+                 throttle_rate: float = 0.0, max_attempts: int = 10, seed: int = 0) -> None:
+        self.groups = {group['AutoScalingGroupName']: group for group in groups}
+        self.policies = policies
+        self._policies_by_group = collections.defaultdict(list)
+        for policy in policies:
+            self._policies_by_group[policy['AutoScalingGroupName']].append(policy)
+        # filtered group lists by filters, so paging does not filter the fleet on every call
+        self._filtered = {}
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.max_attempts = max_attempts
+        self._rand = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = collections.Counter()
+        self.throttles = collections.Counter()
+        self.meta = types.SimpleNamespace(events=HierarchicalEmitter())
+
+    def _call(self, operation: str, respond, params: dict = None,
+              latency: float = None) -> dict:
+        """
+            Counts the call, sleeps the latency, simulates throttling with retries
+            and returns the response built by respond(), params are the call arguments
+            and latency overrides the latency of the client for this call
+        """
+        model = types.SimpleNamespace(name=operation)
+        context = {}
+        latency = self.latency if latency is None else latency
+        self.meta.events.emit('before-parameter-build.autoscaling.{}'.format(operation),
+                              params=dict(params or {}), model=model, context=context)
+        self.meta.events.emit('before-call.autoscaling.{}'.format(operation),
+                              model=model, params={}, request_signer=None, context=context)
+        with self._lock:
+            self.calls[operation] += 1
+        error = {'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}}
+        for attempt in range(1, self.max_attempts + 1):
+            self.meta.events.emit('before-send.autoscaling.{}'.format(operation), request=None)
+            if latency:
+                time.sleep(latency)
+            with self._lock:
+                throttled = self._rand.random() < self.throttle_rate
+                if throttled:
+                    self.throttles[operation] += 1
+            if not throttled:
+                break
+            self.meta.events.emit('needs-retry.autoscaling.{}'.format(operation),
+                                  response=(None, error), operation=model, attempts=attempt,
+                                  caught_exception=None, request_dict={})
+        else:
+            parsed = dict(error, ResponseMetadata={'RetryAttempts': self.max_attempts - 1})
+            self.meta.events.emit('after-call.autoscaling.{}'.format(operation),
+                                  http_response=None, parsed=parsed, model=model,
+                                  context=context)
+            raise ClientError(parsed, operation)
+        body = json.dumps(respond(), default=str)
+        parsed = json.loads(body)
+        parsed['ResponseMetadata'] = {'RetryAttempts': attempt - 1}
+        http_response = types.SimpleNamespace(headers={'content-length': len(body)}, content=None)
+        self.meta.events.emit('after-call.autoscaling.{}'.format(operation),
+                              http_response=http_response, parsed=parsed, model=model,
+                              context=context)
+        return parsed
+
+    @staticmethod
+    def _page(items: list, key: str, kwargs: dict, default_size: int) -> dict:
+        """
+            Slices one page of items using NextToken and MaxRecords
+        """
+        start = int(kwargs.get('NextToken') or 0)
+        end = start + int(kwargs.get('MaxRecords') or default_size)
+        page = {key: items[start:end]}
+        if end < len(items):
+            page['NextToken'] = str(end)
+        return page
+
+    @staticmethod
+    def _matches(group: dict, filters: list) -> bool:
+        """
+            Applies the tag:<key>, tag-key and tag-value filters to a group
+        """
+        tags = group.get('Tags', [])
+        for tag_filter in filters or []:
+            name, values = tag_filter['Name'], tag_filter['Values']
+            if name.startswith('tag:'):
+                matched = any(tag['Key'] == name[4:] and tag['Value'] in values for tag in tags)
+            elif name == 'tag-key':
+                matched = any(tag['Key'] in values for tag in tags)
+            elif name == 'tag-value':
+                matched = any(tag['Value'] in values for tag in tags)
+            else:
+                raise ClientError({'Error': {'Code': 'ValidationError',
+                                             'Message': 'Unknown filter {}'.format(name)}},
+                                  'DescribeAutoScalingGroups')
+            if not matched:
+                return False
+        return True
+
+    def describe_auto_scaling_groups(self, **kwargs) -> dict:
+        """
+            Fake describe_auto_scaling_groups
+        """
+        def respond():
+            filters = kwargs.get('Filters')
+            if kwargs.get('AutoScalingGroupNames'):
+                groups = [self.groups[name] for name in kwargs['AutoScalingGroupNames']
+                          if name in self.groups and self._matches(self.groups[name], filters)]
+            else:
+                filters_key = json.dumps(filters, sort_keys=True)
+                with self._lock:
+                    if filters_key not in self._filtered:
+                        self._filtered[filters_key] = [
+                            group for group in self.groups.values()
+                            if self._matches(group, filters)]
+                    groups = self._filtered[filters_key]
+            page = self._page(groups, 'AutoScalingGroups', kwargs, 50)
+            if kwargs.get('IncludeInstances') is False:
+                page['AutoScalingGroups'] = [
+                    {key: value for key, value in group.items() if key != 'Instances'}
+                    for group in page['AutoScalingGroups']]
+            return page
+        return self._call('DescribeAutoScalingGroups', respond, kwargs)
+
+    def describe_policies(self, **kwargs) -> dict:
+        """
+            Fake describe_policies
+        """
+        def respond():
+            policies = self.policies
+            if kwargs.get('AutoScalingGroupName'):
+                policies = self._policies_by_group.get(kwargs['AutoScalingGroupName'], [])
+            return self._page(policies, 'ScalingPolicies', kwargs, 50)
+        return self._call('DescribePolicies', respond, kwargs)
+
+    def set_desired_capacity(self, AutoScalingGroupName: str, DesiredCapacity: int,
+                             **_kwargs) -> dict:
+        """
+            Fake set_desired_capacity
+        """
+        def respond():
+            with self._lock:
+                self.groups[AutoScalingGroupName]['DesiredCapacity'] = DesiredCapacity
+            return {}
+        return self._call('SetDesiredCapacity', respond,
+                          dict(_kwargs, AutoScalingGroupName=AutoScalingGroupName,
+                               DesiredCapacity=DesiredCapacity))
+
+    def get_paginator(self, operation: str) -> FakePaginator:
+        """
+            Returns a paginator over one of the fake describe operations
+        """
+        return FakePaginator(self, operation)
+
+
+# keys whose values are pseudonymised by default when recording a cassette
+DEFAULT_REDACT_KEYS = ('AutoScalingGroupARN', 'PolicyARN', 'ServiceLinkedRoleARN', 'AlarmARN',
+                       'TopicARN', 'RoleARN')
+
+
+def _pseudonym(value):
+    """
+        Returns a stable pseudonym of a string, or of every string of a list,
+        so a redacted name still matches between requests and responses
+    """
+    if isinstance(value, list):
+        return [_pseudonym(item) for item in value]
+    if isinstance(value, str):
+        return 'redacted-{}'.format(hashlib.sha256(value.encode('utf-8')).hexdigest()[:12])
+    return value
+
+
+def redact_document(document, keys):
+    """
+        Returns a copy of a request or response where the values of the given keys,
+        at any depth, are replaced by their pseudonym
+    """
+    if isinstance(document, dict):
+        return {key: _pseudonym(value) if key in keys else redact_document(value, keys)
+                for key, value in document.items()}
+    if isinstance(document, list):
+        return [redact_document(item, keys) for item in document]
+    return document
+
+
+class RecordingClient:
+    """
+        Wraps an autoscaling client and records every API call it makes, including
+        the pages fetched by its paginators, to a gzip JSON lines cassette with the
+        call parameters, the response and its latency. The calls are captured from the
+        client events, so any botocore client (or FakeAutoScalingClient) can be wrapped;
+        every other attribute is the one of the wrapped client.
+    """
+    def __init__(self, client, path: str, redact_keys=DEFAULT_REDACT_KEYS, redact=None) -> None:
+        """
+            Parameters
+            ----------
+            client : botocore client
+                Client to record, e.g. the one of AsgCount()
+            path : str
+                Cassette file, overwritten
+            redact_keys : iterable of str
+                Keys whose values are pseudonymised in parameters and responses, e.g. add
+                AutoScalingGroupName and AutoScalingGroupNames to hide the group names
+            redact : callable
+                Called with (operation, params, response), returns the (params, response)
+                to record, applied after redact_keys
+        """
+        self._client = client
+        self.path = path
+        self.redact_keys = frozenset(redact_keys or ())
+        self.redact = redact
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        client.meta.events.register('before-parameter-build.autoscaling', self._before_call)
+        client.meta.events.register('after-call.autoscaling', self._after_call)
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+    def _before_call(self, params=None, context=None, **_kwargs) -> None:
+        if context is not None:
+            context['cassette_params'] = dict(params or {})
+            context['cassette_start'] = time.perf_counter()
+
+    def _after_call(self, model=None, parsed=None, context=None, **_kwargs) -> None:
+        context = context or {}
+        latency = time.perf_counter() - context.get('cassette_start', time.perf_counter())
+        params = context.get('cassette_params', {})
+        response = {key: value for key, value in (parsed or {}).items()
+                    if key != 'ResponseMetadata'}
+        if self.redact_keys:
+            params = redact_document(params, self.redact_keys)
+            response = redact_document(response, self.redact_keys)
+        if self.redact is not None:
+            params, response = self.redact(model.name, params, response)
+        line = json.dumps({'operation': model.name, 'params': params, 'response': response,
+                           'latency': round(latency, 6)}, separators=(',', ':'), default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self.recorded += 1
+
+    def close(self) -> None:
+        """
+            Stops recording and closes the cassette
+        """
+        self._client.meta.events.unregister('before-parameter-build.autoscaling',
+                                            self._before_call)
+        self._client.meta.events.unregister('after-call.autoscaling', self._after_call)
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self) -> 'RecordingClient':
+        return self
+
+    def __exit__(self, *_exc_info) -> None:
+        self.close()
+
+
+class ReplayClient(FakeAutoScalingClient):
+    """
+        Serves the calls recorded in a cassette, with their recorded pagination, payloads
+        and latencies scaled by latency_scale (0 for no wait). Calls are matched on their
+        operation and parameters, MaxRecords aside, identical calls get the recorded
+        responses in order and the last one once they are used up. Recorded errors are
+        raised as ClientError. Operations missing from the cassette are answered with
+        default_responses, so a read-only recording (e.g. a dry run) can replay full sweeps,
+        any other call missing from the cassette raises KeyError.
+    """
+    def __init__(self, path: str, latency_scale: float = 1.0,
+                 default_responses: dict = None) -> None:
+        super().__init__([], [])
+        self.latency_scale = latency_scale
+        self.default_responses = {'SetDesiredCapacity': {}} if default_responses is None \
+            else default_responses
+        self._recorded = collections.defaultdict(collections.deque)
+        with gzip.open(path, 'rt', encoding='utf-8') as cassette:
+            for line in cassette:
+                entry = json.loads(line)
+                self._recorded[self._key(entry['operation'], entry['params'])].append(entry)
+
+    @staticmethod
+    def _key(operation: str, params: dict) -> tuple:
+        params = {key: value for key, value in params.items() if key != 'MaxRecords'}
+        return operation, json.dumps(params, sort_keys=True, default=str)
+
+    def _replay(self, operation: str, params: dict) -> dict:
+        with self._lock:
+            recorded = self._recorded.get(self._key(operation, params))
+            if recorded:
+                entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+            elif operation in self.default_responses:
+                entry = {'response': self.default_responses[operation], 'latency': 0.0}
+            else:
+                raise KeyError('No recorded {} call with {}'.format(operation, params))
+        parsed = self._call(operation, lambda: entry['response'], params,
+                            latency=entry['latency'] * self.latency_scale)
+        if 'Error' in parsed:
+            raise ClientError(parsed, operation)
+        return parsed
+
+    def describe_auto_scaling_groups(self, **kwargs) -> dict:
+        """
+            Replayed describe_auto_scaling_groups
+        """
+        return self._replay('DescribeAutoScalingGroups', kwargs)
+
+    def describe_policies(self, **kwargs) -> dict:
+        """
+            Replayed describe_policies
+        """
+        return self._replay('DescribePolicies', kwargs)
+
+    def set_desired_capacity(self, **kwargs) -> dict:
+        """
+            Replayed set_desired_capacity
+        """
+        return self._replay('SetDesiredCapacity', kwargs)
+
+
+def _legacy_sweep(asg_count: AsgCount) -> dict:
+    """
+        The original run(): one describe and one describe_policies call per matched ASG
+    """
+    results = {}
+    for name in asg_count.get_names_filtered(BENCH_TAG_KEY, BENCH_TAG_VALUE):
+        desired, max_cap = asg_count.get_asg_desired_max_capacity(name)
+        results[name] = False
+        if desired < max_cap and asg_count.check_scaling_policy(name):
+            asg_count.increase_desired_capacity(name, desired + 1)
+            results[name] = True
+    return results
+
+
+def run_benchmark(mode: str, count: int, latency: float = 0.0, throttle_rate: float = 0.0,
+                  workers: int = 16, match_ratio: float = 0.05, shards: int = 4,
+                  churn: float = 0.01, cassette: str = None,
+                  latency_scale: float = 1.0, trace_memory: bool = False) -> dict:
+    """
+        Runs one sweep against a fresh fake fleet and measures it
+
+        Parameters
+        ----------
+        mode : str
+            'legacy', 'sweep', 'threaded', 'async', 'sharded' or 'incremental'
+        count : int
+            Number of ASG in the fake account, unused with a cassette
+        latency : float
+            Seconds slept by every fake API call
+        throttle_rate : float
+            Probability of a fake API call being throttled
+        workers : int
+            Threads or coroutines of the 'threaded' and 'async' modes
+        match_ratio : float
+            Share of the ASG matching the tag filter
+        shards : int
+            Workers of the 'sharded' mode, run one after another on the same fleet,
+            its wall_seconds is the slowest shard as when they run in parallel
+        churn : float
+            Share of the matched ASG changed between the two cycles of the 'incremental'
+            mode, its wall_seconds and cycle_calls are those of the event driven cycle
+        cassette : str
+            Cassette recorded by RecordingClient, replayed instead of the fake fleet,
+            the tag filter is then the one of ASG_TAG_NAME and ASG_TAG_VALUE,
+            only the CASSETTE_MODES can be replayed
+        latency_scale : float
+            Factor applied to the recorded latencies of the cassette
+        trace_memory : bool
+            Traces the allocations to report peak_memory_bytes, tracemalloc slows the
+            sweep down by an order of magnitude so wall_seconds is then meaningless,
+            time and trace memory in separate runs
+
+        Returns
+        -------
+        report : dict
+            mode, groups, matched, increased, wall_seconds,
+            peak_memory_bytes (None unless trace_memory),
+            calls and throttles per operation and the AsgMetrics summary,
+            plus shard_seconds and duplicates for the 'sharded' mode
+            and cycle_calls for the 'incremental' mode
+    """
+    # per ASG info logging would dominate the measurement
+    environ = {'LOG_LEVEL': 'WARNING'}
+    if cassette:
+        if mode not in CASSETTE_MODES:
+            raise ValueError('The {} mode cannot replay a cassette, use one of {}'.format(
+                mode, ', '.join(CASSETTE_MODES)))
+        client = ReplayClient(cassette, latency_scale=latency_scale)
+    else:
+        groups, policies = make_fleet(count, match_ratio=match_ratio)
+        client = FakeAutoScalingClient(groups, policies, latency=latency,
+                                       throttle_rate=throttle_rate)
+        environ.update(ASG_TAG_NAME=BENCH_TAG_KEY, ASG_TAG_VALUE=BENCH_TAG_VALUE)
+    metrics = AsgMetrics()
+    previous = {key: os.environ.get(key) for key in environ}
+    os.environ.update(environ)
+    shard_seconds = []
+    duplicates = 0
+    cycle_calls = {}
+    peak_memory = None
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        if mode == 'legacy':
+            results = _legacy_sweep(AsgCount(asg_client=client, use_policy_index=False,
+                                             metrics=metrics))
+        elif mode == 'sweep':
+            results = AsgCount(asg_client=client, metrics=metrics).run()
+        elif mode == 'threaded':
+            results = AsgCount(asg_client=client, max_workers=workers, metrics=metrics).run()
+        elif mode == 'async':
+            results = asyncio.run(AsyncAsgCount(asg_client=_ThreadedAsyncClient(client),
+                                                max_concurrency=workers, metrics=metrics).run())
+        elif mode == 'sharded':
+            results = {}
+            # every run() starts the phases and outcomes again, they are summed over the shards
+            phases, outcomes = collections.Counter(), collections.Counter()
+            for shard_index in range(shards):
+                shard_start = time.perf_counter()
+                shard_results = AsgCount(asg_client=client, max_workers=workers, metrics=metrics,
+                                         shard_index=shard_index, shard_count=shards).run()
+                shard_seconds.append(round(time.perf_counter() - shard_start, 4))
+                duplicates += len(results.keys() & shard_results.keys())
+                results.update(shard_results)
+                phases.update(metrics.phases)
+                outcomes.update(metrics.outcomes)
+            metrics.phases, metrics.outcomes = phases, outcomes
+        elif mode == 'incremental':
+            with tempfile.TemporaryDirectory() as queue:
+                incremental = AsgIncrementalSweep(
+                    AsgCount(asg_client=client, max_workers=workers, metrics=metrics),
+                    DirectoryEventSource(queue))
+                incremental.cycle()
+                full_calls = dict(client.calls)
+                matched = sorted(incremental.records)
+                changed = matched[:max(int(len(matched) * churn), 1)] if matched else []
+                for name in changed:
+                    client.groups[name]['MaxSize'] += 1
+                with open(os.path.join(queue, 'events.json'), 'w', encoding='utf-8') as queued:
+                    json.dump([{'source': 'aws.autoscaling',
+                                'detail-type': 'AWS API Call via CloudTrail',
+                                'detail': {'eventName': 'UpdateAutoScalingGroup',
+                                           'requestParameters': {'autoScalingGroupName': name}}}
+                               for name in changed], queued)
+                start = time.perf_counter()
+                results = incremental.cycle()
+            cycle_calls = {operation: calls - full_calls.get(operation, 0)
+                           for operation, calls in client.calls.items()
+                           if calls != full_calls.get(operation, 0)}
+        else:
+            raise ValueError('Unknown benchmark mode {}'.format(mode))
+        wall_seconds = max(shard_seconds) if shard_seconds else time.perf_counter() - start
+        if trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    report = {
+        'mode': mode,
+        'groups': count,
+        'matched': len(results),
+        'increased': sum(outcome is True for outcome in results.values()),
+        'wall_seconds': round(wall_seconds, 4),
+        'peak_memory_bytes': peak_memory,
+        'calls': dict(client.calls),
+        'throttles': dict(client.throttles),
+        'metrics': metrics.to_dict(),
+    }
+    if mode == 'sharded':
+        report.update(shard_seconds=shard_seconds, duplicates=duplicates)
+    if mode == 'incremental':
+        report.update(cycle_calls=cycle_calls)
+    return report
+
+
+def measure_startup(runs: int = 5) -> dict:
+    """
+        Measures in fresh interpreters the import time of Asg_count, the creation time
+        of an AsgCount with an injected client, with the default client and with a
+        client of the cached default session, and which heavy modules the injected path loads
+
+        Parameters
+        ----------
+        runs : int
+            Number of interpreters started, the median of each timing is reported
+
+        Returns
+        -------
+        report : dict
+            import_ms, injected_startup_ms, default_startup_ms, reused_startup_ms
+            and heavy_modules loaded by import plus injected client startup
+    """
+    environ = dict(os.environ, AWS_DEFAULT_REGION=os.getenv('AWS_DEFAULT_REGION', 'us-east-1'))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], check=True,
+                                capture_output=True, text=True, env=environ,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    report = {key: round(statistics.median(sample[key] for sample in samples), 3)
+              for key in samples[0] if key.endswith('_ms')}
+    report['heavy_modules'] = sorted({module for sample in samples
+                                      for module in sample['heavy_modules']})
+    return report
+
+
+def check_startup_budget(report: dict, import_budget_ms: float = None,
+                         injected_budget_ms: float = None) -> list:
+    """
+        Compares a measure_startup() report with the startup budget
+
+        Parameters
+        ----------
+        report : dict
+            Report returned by measure_startup()
+        import_budget_ms : float
+            Maximum import time, defaults to ASG_IMPORT_BUDGET_MS or 100
+        injected_budget_ms : float
+            Maximum AsgCount creation time with an injected client,
+            defaults to ASG_STARTUP_BUDGET_MS or 10
+
+        Returns
+        -------
+        violations : list of str
+            One message per exceeded budget, empty when within budget
+    """
+    import_budget_ms = import_budget_ms or float(os.getenv('ASG_IMPORT_BUDGET_MS', '100'))
+    injected_budget_ms = injected_budget_ms or float(os.getenv('ASG_STARTUP_BUDGET_MS', '10'))
+    violations = []
+    if report['import_ms'] > import_budget_ms:
+        violations.append('import took {} ms, budget {} ms'.format(
+            report['import_ms'], import_budget_ms))
+    if report['injected_startup_ms'] > injected_budget_ms:
+        violations.append('startup with injected client took {} ms, budget {} ms'.format(
+            report['injected_startup_ms'], injected_budget_ms))
+    if report['heavy_modules']:
+        violations.append('import loaded {}'.format(', '.join(report['heavy_modules'])))
+    return violations
+
+
+def _main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--groups', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--modes', nargs='+',
+                        help='default legacy, sweep, threaded and async, without legacy '
+                             'when replaying')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--match-ratio', type=float, default=0.05)
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--churn', type=float, default=0.01)
+    parser.add_argument('--startup', action='store_true',
+                        help='measure import and startup time against the budget instead')
+    parser.add_argument('--record', metavar='CASSETTE',
+                        help='record a dry run sweep of the real account to a cassette instead')
+    parser.add_argument('--redact', nargs='*', default=[],
+                        help='keys pseudonymised in the cassette on top of the ARNs')
+    parser.add_argument('--replay', metavar='CASSETTE',
+                        help='run the modes against a recorded cassette instead of a fake fleet')
+    parser.add_argument('--latency-scale', type=float, default=1.0)
+    parser.add_argument('--memory', action='store_true',
+                        help='also measure the peak memory, in a separate traced run')
+    args = parser.parse_args()
+    modes = args.modes or ['legacy', 'sweep', 'threaded', 'async']
+    if args.replay:
+        if not args.modes:
+            modes = [mode for mode in modes if mode in CASSETTE_MODES]
+        unsupported = [mode for mode in modes if mode not in CASSETTE_MODES]
+        if unsupported:
+            parser.error('--replay cannot serve the {} mode(s), use one of {}'.format(
+                ', '.join(unsupported), ', '.join(CASSETTE_MODES)))
+    if args.record:
+        # only describe calls are made, the account is not modified
+        asg_count = AsgCount()
+        with RecordingClient(asg_count._asg, args.record,
+                             DEFAULT_REDACT_KEYS + tuple(args.redact)) as recorder:
+            asg_count.plan_sweep()
+        print(json.dumps({'cassette': args.record, 'calls': recorder.recorded}))
+        return
+    if args.startup:
+        report = measure_startup()
+        violations = check_startup_budget(report)
+        print(json.dumps(dict(report, violations=violations)))
+        sys.exit(1 if violations else 0)
+    for count in [None] if args.replay else args.groups:
+        for mode in modes:
+            options = dict(latency=args.latency, throttle_rate=args.throttle_rate,
+                           workers=args.workers, match_ratio=args.match_ratio,
+                           shards=args.shards, churn=args.churn, cassette=args.replay,
+                           latency_scale=args.latency_scale)
+            report = run_benchmark(mode, count, **options)
+            if args.memory:
+                # the traced run is only kept for its peak, its timing is skewed
+                report['peak_memory_bytes'] = run_benchmark(
+                    mode, count, trace_memory=True, **options)['peak_memory_bytes']
+            print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    _main()
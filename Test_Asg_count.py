@@ -1,9 +1,16 @@
 """
     Unit test cases for asgtest
 """
+import asyncio
+import gzip
+import json
 import unittest
 import os
-from unittest.mock import MagicMock
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock, patch
+from botocore.exceptions import ClientError
 from asgtest import asgtest as tool
 
 
@@ -358,6 +365,897 @@ class TestAsgCount(unittest.TestCase):
         self.assertEqual(None, filter_key)
         self.assertEqual(None, filter_value)
 
+    @staticmethod
+    def get_asg_record(name='Demo_ASG_1', desired=1, max_cap=5):
+        """
+        Static method to build a minimal describe_auto_scaling_groups record
+        """
+        return {
+            "AutoScalingGroupName": name,
+            "MinSize": 1,
+            "MaxSize": max_cap,
+            "DesiredCapacity": desired,
+            "Tags": [{"Key": "Test_key", "Value": "Test_value"}],
+        }
+
+    def test_process_asg_increase(self):
+        """
+        Method to validate process_asg increases desired capacity
+        using only the paginated record
+        """
+        self.asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+        result = self.asg_obj.process_asg(self.get_asg_record(desired=2, max_cap=5))
+        self.assertTrue(result)
+        self.asg_obj._asg.set_desired_capacity.assert_called_once_with(
+            AutoScalingGroupName='Demo_ASG_1', DesiredCapacity=3, HonorCooldown=False)
+
+    def test_process_asg_at_max(self):
+        """
+        Method to validate process_asg skips an ASG already at maximum capacity
+        """
+        result = self.asg_obj.process_asg(self.get_asg_record(desired=5, max_cap=5))
+        self.assertFalse(result)
+        self.asg_obj._asg.describe_policies.assert_not_called()
+        self.asg_obj._asg.set_desired_capacity.assert_not_called()
+
+    @patch.dict(os.environ, {"ASG_TAG_NAME": "Test_key", "ASG_TAG_VALUE": "Test_value"})
+    def test_run_single_pass(self):
+        """
+        Method to validate run() reuses the paginated records
+        instead of describing every ASG again
+        """
+        self.asg_obj.use_policy_index = False
+        self.asg_obj._asg.get_paginator.return_value. \
+            paginate.return_value. \
+            search.return_value = iter([self.get_asg_record(), self.get_asg_record('Demo_ASG_2')])
+        self.asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+        self.asg_obj.run()
+        self.asg_obj._asg.describe_auto_scaling_groups.assert_not_called()
+        self.assertEqual(2, self.asg_obj._asg.set_desired_capacity.call_count)
+
+    def test_build_policy_index(self):
+        """
+        Method to validate check_scaling_policy is a set lookup once the index is built
+        """
+        self.asg_obj._asg.get_paginator.return_value. \
+            paginate.return_value. \
+            search.return_value = iter(['Demo_ASG_1', 'Demo_ASG_1', 'Demo_ASG_2'])
+        index = self.asg_obj.build_policy_index()
+        self.assertEqual({'Demo_ASG_1', 'Demo_ASG_2'}, index)
+        self.asg_obj._asg.get_paginator.assert_called_with('describe_policies')
+        self.assertTrue(self.asg_obj.check_scaling_policy('Demo_ASG_2'))
+        self.assertFalse(self.asg_obj.check_scaling_policy('Demo_ASG_3'))
+        self.asg_obj._asg.describe_policies.assert_not_called()
+
+    @patch.dict(os.environ, {"ASG_TAG_NAME": "Test_key", "ASG_TAG_VALUE": "Test_value"})
+    def test_run_with_policy_index(self):
+        """
+        Method to validate run() uses one describe_policies pagination
+        instead of one describe_policies call per ASG
+        """
+        paginators = {
+            'describe_auto_scaling_groups': MagicMock(name='asg_paginator'),
+            'describe_policies': MagicMock(name='policy_paginator'),
+        }
+        paginators['describe_auto_scaling_groups'].paginate.return_value.\
+            search.return_value = iter([self.get_asg_record(), self.get_asg_record('Demo_ASG_2')])
+        paginators['describe_policies'].paginate.return_value.\
+            search.return_value = iter(['Demo_ASG_2'])
+        self.asg_obj._asg.get_paginator.side_effect = paginators.get
+        self.asg_obj.run()
+        self.asg_obj._asg.describe_policies.assert_not_called()
+        self.asg_obj._asg.set_desired_capacity.assert_called_once_with(
+            AutoScalingGroupName='Demo_ASG_2', DesiredCapacity=2, HonorCooldown=False)
+
+    def test_get_asgs_filtered_server_side(self):
+        """
+        Method to validate the tag filter is sent to describe_auto_scaling_groups
+        """
+        self.asg_obj._asg.get_paginator.return_value. \
+            paginate.return_value. \
+            search.return_value = iter([self.get_asg_record()])
+        result = self.asg_obj.get_asgs_filtered(key='Test_key', value='Test_value')
+        self.assertEqual(['Demo_ASG_1'], [asg.name for asg in result])
+        self.asg_obj._asg.get_paginator.return_value.paginate.assert_called_once_with(
+            PaginationConfig={'MaxItems': 100000, 'PageSize': 100},
+            Filters=[{'Name': 'tag:Test_key', 'Values': ['Test_value']}],
+            IncludeInstances=False)
+
+    def test_get_asgs_filtered_fallback(self):
+        """
+        Method to validate IncludeInstances and then the tag filter are dropped, and the
+        client side filter is used, only when the service rejects the parameters
+        """
+        error = ClientError({'Error': {'Code': 'ValidationError', 'Message': 'Filters'}},
+                            'DescribeAutoScalingGroups')
+        paginate = self.asg_obj._asg.get_paginator.return_value.paginate
+        paginate.return_value.search.side_effect = [error, error, iter([self.get_asg_record()])]
+        result = self.asg_obj.get_asgs_filtered(key='Test_key', value='Test_value')
+        self.assertEqual(1, len(result))
+        # (Filters, IncludeInstances) sent by each attempt
+        self.assertEqual([(True, True), (True, False), (False, False)],
+                         [('Filters' in call[1], 'IncludeInstances' in call[1])
+                          for call in paginate.call_args_list])
+
+    def test_get_asgs_filtered_throttled(self):
+        """
+        Method to validate a throttled or denied first page is raised and does not turn
+        the server side tag filter off
+        """
+        throttled = ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}},
+                                'DescribeAutoScalingGroups')
+        paginate = self.asg_obj._asg.get_paginator.return_value.paginate
+        paginate.return_value.search.side_effect = [throttled, iter([self.get_asg_record()])]
+        self.assertRaises(ClientError, self.asg_obj.get_asgs_filtered, 'Test_key', 'Test_value')
+        self.assertEqual(1, len(self.asg_obj.get_asgs_filtered('Test_key', 'Test_value')))
+        self.assertEqual(False, paginate.call_args[1]['IncludeInstances'])
+
+    def test_process_asgs_concurrent(self):
+        """
+        Method to validate the thread pool collects results and errors per ASG
+        """
+        self.asg_obj.max_workers = 4
+        self.asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+        error = ClientError({'Error': {'Code': 'ValidationError', 'Message': 'Failed'}},
+                            'SetDesiredCapacity')
+
+        def set_desired_capacity(AutoScalingGroupName, **_kwargs):
+            if AutoScalingGroupName == 'Demo_ASG_3':
+                raise error
+
+        self.asg_obj._asg.set_desired_capacity.side_effect = set_desired_capacity
+        asgs = [self.get_asg_record('Demo_ASG_{}'.format(index)) for index in range(10)]
+        asgs.append(self.get_asg_record('Demo_ASG_full', desired=5, max_cap=5))
+        results = self.asg_obj.process_asgs(asgs)
+        self.assertEqual(11, len(results))
+        self.assertIs(error, results['Demo_ASG_3'])
+        self.assertFalse(results['Demo_ASG_full'])
+        self.assertTrue(results['Demo_ASG_0'])
+        self.assertEqual(10, self.asg_obj._asg.set_desired_capacity.call_count)
+
+    def test_iter_asgs_filtered_streams(self):
+        """
+        Method to validate records are yielded as the pages are consumed
+        """
+        pages = iter([self.get_asg_record('Demo_ASG_1'), self.get_asg_record('Demo_ASG_2')])
+        self.asg_obj._asg.get_paginator.return_value. \
+            paginate.return_value. \
+            search.return_value = pages
+        stream = self.asg_obj.iter_asgs_filtered(key='Test_key', value='Test_value')
+        self.assertEqual('Demo_ASG_1', next(stream).name)
+        # second record is still not fetched from the paginator
+        self.assertEqual('Demo_ASG_2', next(pages)['AutoScalingGroupName'])
+
+    def test_process_asgs_concurrent_stream(self):
+        """
+        Method to validate the thread pool consumes a generator of ASG records
+        """
+        self.asg_obj.max_workers = 2
+        self.asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+        asgs = (self.get_asg_record('Demo_ASG_{}'.format(index)) for index in range(25))
+        results = self.asg_obj.process_asgs(asgs)
+        self.assertEqual(25, len(results))
+        self.assertTrue(all(results.values()))
+
+    def test_async_run(self):
+        """
+        Method to validate AsyncAsgCount.run() against an injected async fake client,
+        with the server side filter fallback, journal and decision report of AsgCount
+        """
+
+        class FakeAsyncClient:
+            """
+            Async fake client serving two pages of ASG and one page of policies
+            """
+            def __init__(self, records):
+                self.records = records
+                self.updated = []
+
+            async def describe_auto_scaling_groups(self, **kwargs):
+                if kwargs.get('IncludeInstances') is False:
+                    raise ClientError({'Error': {'Code': 'ValidationError', 'Message': ''}},
+                                      'DescribeAutoScalingGroups')
+                if kwargs.get('NextToken'):
+                    return {"AutoScalingGroups": self.records[1:]}
+                return {"AutoScalingGroups": self.records[:1], "NextToken": "page2"}
+
+            async def describe_policies(self, **_kwargs):
+                return {"ScalingPolicies": [{"AutoScalingGroupName": "Demo_ASG_2"},
+                                            {"AutoScalingGroupName": "Demo_ASG_3"}]}
+
+            async def set_desired_capacity(self, AutoScalingGroupName, DesiredCapacity, **_kwargs):
+                self.updated.append((AutoScalingGroupName, DesiredCapacity))
+
+        os.environ["ASG_TAG_NAME"] = "Test_key"
+        os.environ["ASG_TAG_VALUE"] = "Test_value"
+        client = FakeAsyncClient([self.get_asg_record('Demo_ASG_1'),
+                                  self.get_asg_record('Demo_ASG_2', desired=2),
+                                  self.get_asg_record('Demo_ASG_3', desired=5)])
+        journal, decision_report = MagicMock(), MagicMock()
+        journal.begin.return_value = 0
+        journal.handled.return_value = False
+        async_count = tool.AsyncAsgCount(asg_client=client, max_concurrency=2, journal=journal,
+                                         decision_report=decision_report)
+        try:
+            results = asyncio.run(async_count.run())
+        finally:
+            del os.environ["ASG_TAG_NAME"]
+            del os.environ["ASG_TAG_VALUE"]
+        self.assertEqual({'Demo_ASG_1': False, 'Demo_ASG_2': True, 'Demo_ASG_3': False}, results)
+        self.assertEqual([('Demo_ASG_2', 3)], client.updated)
+        # the fallback state and the bookkeeping are the ones of the AsgCount
+        self.assertEqual(1, async_count.asg_count._server_filter_level)
+        journal.intent.assert_called_once_with('Demo_ASG_2', 3)
+        journal.finish.assert_called_once_with()
+        self.assertEqual(3, decision_report.write.call_count)
+        decision_report.close.assert_called_once_with()
+        self.assertEqual({'increased': 1, 'untouched': 2},
+                         async_count.asg_count.metrics.outcomes)
+
+    def test_get_targets(self):
+        """
+        Method to validate every region is combined with every role
+        """
+        os.environ["ASG_REGIONS"] = "us-east-1, us-west-2"
+        os.environ["ASG_ROLE_ARNS"] = "arn:aws:iam::111111111111:role/Demo"
+        try:
+            targets = tool.get_targets()
+        finally:
+            del os.environ["ASG_REGIONS"]
+            del os.environ["ASG_ROLE_ARNS"]
+        self.assertEqual([('us-east-1', 'arn:aws:iam::111111111111:role/Demo'),
+                          ('us-west-2', 'arn:aws:iam::111111111111:role/Demo')], targets)
+        self.assertEqual([(None, None)], tool.get_targets())
+
+    def test_run_targets(self):
+        """
+        Method to validate the per target summaries are merged
+        """
+        error = ClientError({'Error': {'Code': 'ValidationError', 'Message': 'Failed'}},
+                            'SetDesiredCapacity')
+        asg_counts = {
+            'us-east-1': MagicMock(**{'run.return_value': {'Demo_ASG_1': True,
+                                                           'Demo_ASG_2': False}}),
+            'us-west-2': MagicMock(**{'run.return_value': {'Demo_ASG_3': error}}),
+        }
+        with patch.object(tool, '_target_asg_count',
+                          side_effect=lambda region, role_arn: asg_counts[region]):
+            summary = tool.run_targets([('us-east-1', None), ('us-west-2', None)], processes=1)
+        self.assertEqual(1, summary['increased'])
+        self.assertEqual(1, summary['untouched'])
+        self.assertEqual(1, summary['errors'])
+        self.assertEqual(['Demo_ASG_1'], summary['targets'][0]['increased'])
+
+    def test_snapshot_cache(self):
+        """
+        Method to validate a fresh snapshot skips the pagination and
+        the ASG increased by the previous sweep are described again
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'snapshot.json')
+            self.asg_obj.use_policy_index = False
+            self.asg_obj.snapshot_cache = tool.AsgSnapshotCache(path, ttl=300, full_ttl=3600)
+            self.asg_obj._asg.get_paginator.return_value. \
+                paginate.return_value. \
+                search.return_value = iter([self.get_asg_record('Demo_ASG_1'),
+                                            self.get_asg_record('Demo_ASG_2', desired=5)])
+            self.asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+            first = list(self.asg_obj.iter_asgs_cached('Test_key', 'Test_value'))
+            self.assertEqual(2, len(first))
+            self.assertTrue(self.asg_obj.process_asg(first[0]))
+            self.asg_obj.snapshot_cache.save()
+
+            self.asg_obj.snapshot_cache = tool.AsgSnapshotCache(path, ttl=300, full_ttl=3600)
+            self.asg_obj._asg.get_paginator.reset_mock()
+            self.asg_obj._asg.describe_auto_scaling_groups.return_value = {
+                "AutoScalingGroups": [self.get_asg_record('Demo_ASG_1', desired=2)]}
+            second = list(self.asg_obj.iter_asgs_cached('Test_key', 'Test_value'))
+            self.asg_obj._asg.get_paginator.assert_not_called()
+            self.asg_obj._asg.describe_auto_scaling_groups.assert_called_once_with(
+                AutoScalingGroupNames=['Demo_ASG_1'])
+            self.assertEqual({'Demo_ASG_1': 2, 'Demo_ASG_2': 5},
+                             {asg.name: asg.desired for asg in second})
+
+    def test_snapshot_cache_stale(self):
+        """
+        Method to validate a stale snapshot describes every cached ASG again
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = tool.AsgSnapshotCache(os.path.join(directory, 'snapshot.json'),
+                                          ttl=0, full_ttl=3600)
+            cache.reset('Test_key', 'Test_value', time.time())
+            cache.put(tool.AsgRecord.from_group(self.get_asg_record('Demo_ASG_1')))
+            cache.put(tool.AsgRecord.from_group(self.get_asg_record('Demo_ASG_2', desired=5)))
+            cache.put(tool.AsgRecord.from_group(self.get_asg_record('Demo_ASG_3')))
+            self.asg_obj.snapshot_cache = cache
+            # Demo_ASG_3 was deleted since the snapshot
+            self.asg_obj._asg.describe_auto_scaling_groups.return_value = {
+                "AutoScalingGroups": [self.get_asg_record('Demo_ASG_1'),
+                                      self.get_asg_record('Demo_ASG_2', desired=5)]}
+            result = list(self.asg_obj.iter_asgs_cached('Test_key', 'Test_value'))
+            self.asg_obj._asg.describe_auto_scaling_groups.assert_called_once_with(
+                AutoScalingGroupNames=['Demo_ASG_1', 'Demo_ASG_2', 'Demo_ASG_3'])
+            self.assertEqual(['Demo_ASG_1', 'Demo_ASG_2'], sorted(asg.name for asg in result))
+
+    def test_snapshot_cache_never_decides_write(self):
+        """
+        Method to validate a fresh snapshot still describes the ASG below maximum
+        capacity before they are processed, and a failed write leaves the ASG invalidated
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = tool.AsgSnapshotCache(os.path.join(directory, 'snapshot.json'),
+                                          ttl=300, full_ttl=3600)
+            cache.reset('Test_key', 'Test_value', time.time())
+            cache.put(tool.AsgRecord.from_group(self.get_asg_record('Demo_ASG_1')))
+            cache.put(tool.AsgRecord.from_group(self.get_asg_record('Demo_ASG_2', desired=5)))
+            self.asg_obj.snapshot_cache = cache
+            self.asg_obj.use_policy_index = False
+            # Demo_ASG_1 was scaled out since the snapshot
+            self.asg_obj._asg.describe_auto_scaling_groups.return_value = {
+                "AutoScalingGroups": [self.get_asg_record('Demo_ASG_1', desired=3)]}
+            result = list(self.asg_obj.iter_asgs_cached('Test_key', 'Test_value'))
+            self.asg_obj._asg.describe_auto_scaling_groups.assert_called_once_with(
+                AutoScalingGroupNames=['Demo_ASG_1'])
+            self.assertEqual({'Demo_ASG_1': 3, 'Demo_ASG_2': 5},
+                             {asg.name: asg.desired for asg in result})
+            self.asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+            self.asg_obj._asg.set_desired_capacity.side_effect = ClientError(
+                {'Error': {'Code': 'ScalingActivityInProgress'}}, 'SetDesiredCapacity')
+            results = self.asg_obj.process_asgs(
+                asg for asg in result if asg.name == 'Demo_ASG_1')
+            self.asg_obj._asg.set_desired_capacity.assert_called_once_with(
+                AutoScalingGroupName='Demo_ASG_1', DesiredCapacity=4, HonorCooldown=False)
+            self.assertIsInstance(results['Demo_ASG_1'], ClientError)
+            self.assertEqual({'Demo_ASG_1'}, cache.dirty)
+
+    @patch.dict(os.environ, {"ASG_TAG_NAME": "Test_key", "ASG_TAG_VALUE": "Test_value",
+                             "ASG_POLICY_INDEX": "false"})
+    def test_snapshot_cache_per_target(self):
+        """
+        Method to validate the targets of a multi-target run keep snapshots of their own,
+        so an account is never served the groups of another account
+        """
+        fleets = {'us-east-1': [self.get_asg_record('East_ASG', desired=5)],
+                  'us-west-2': [self.get_asg_record('West_ASG', desired=5)]}
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.dict(os.environ, {"ASG_CACHE_PATH": os.path.join(directory, 'cache.json')}), \
+                patch.object(tool, '_TARGET_ASG_COUNTS', {}), \
+                patch('boto3.session.Session', side_effect=lambda **_kwargs: MagicMock()):
+            results = {}
+            for region, fleet in fleets.items():
+                asg_obj = tool._target_asg_count(region, None)
+                asg_obj._asg.get_paginator.return_value.paginate.return_value. \
+                    search.side_effect = lambda _expression, fleet=fleet: iter(fleet)
+                results[region] = asg_obj.run()
+        self.assertEqual({'us-east-1': {'East_ASG': False}, 'us-west-2': {'West_ASG': False}},
+                         results)
+
+    def test_metrics_export(self):
+        """
+        Method to validate the metrics hooks and the JSON and Prometheus exports
+        """
+        metrics = tool.AsgMetrics()
+        model = MagicMock()
+        model.name = 'DescribePolicies'
+        context = {}
+        metrics._before_call(context=context)
+        metrics._needs_retry(response=(None, {'Error': {'Code': 'Throttling'}}), operation=model)
+        metrics._after_call(model=model, http_response=MagicMock(headers={'content-length': '42'}),
+                            parsed={'ResponseMetadata': {'RetryAttempts': 1}}, context=context)
+        metrics.record_results({'Demo_ASG_1': True, 'Demo_ASG_2': False})
+        with metrics.phase('run'):
+            pass
+        with tempfile.TemporaryDirectory() as directory:
+            metrics.json_path = os.path.join(directory, 'metrics.json')
+            metrics.prometheus_path = os.path.join(directory, 'metrics.prom')
+            metrics.export()
+            with open(metrics.json_path, encoding='utf-8') as json_file:
+                summary = json.load(json_file)
+            with open(metrics.prometheus_path, encoding='utf-8') as prom_file:
+                prometheus = prom_file.read()
+        counters = summary['operations']['DescribePolicies']
+        self.assertEqual((1, 1, 1, 42), (counters['calls'], counters['retries'],
+                                         counters['throttles'], counters['bytes']))
+        self.assertEqual(1, counters['latency_buckets']['+Inf'])
+        self.assertEqual({'increased': 1, 'untouched': 1}, summary['outcomes'])
+        self.assertIn('run', summary['phases'])
+        self.assertIn('asg_api_calls_total{operation="DescribePolicies"} 1', prometheus)
+        self.assertIn('asg_api_latency_seconds_bucket{operation="DescribePolicies",le="+Inf"} 1',
+                      prometheus)
+        self.assertIn('# TYPE asg_sweep_groups gauge', prometheus)
+        # a new sweep starts its phases and outcomes again, API calls are kept
+        metrics.begin_sweep()
+        summary = metrics.to_dict()
+        self.assertEqual(({}, {}), (summary['phases'], summary['outcomes']))
+        self.assertEqual(1, summary['operations']['DescribePolicies']['calls'])
+
+    def test_plan(self):
+        """
+        Method to validate the plan entries and their JSON round trip
+        """
+        self.asg_obj._asg.describe_policies.side_effect = \
+            lambda AutoScalingGroupName: {"ScalingPolicies": [{}] if AutoScalingGroupName ==
+                                          'Demo_ASG_1' else []}
+        plan = self.asg_obj.plan([self.get_asg_record('Demo_ASG_1'),
+                                  self.get_asg_record('Demo_ASG_2'),
+                                  self.get_asg_record('Demo_ASG_3', desired=5)])
+        self.assertEqual([
+            {'group': 'Demo_ASG_1', 'desired': 1, 'max': 5, 'new_desired': 2,
+             'reason': tool.REASON_INCREASE},
+            {'group': 'Demo_ASG_2', 'desired': 1, 'max': 5, 'new_desired': 1,
+             'reason': tool.REASON_NO_POLICY},
+            {'group': 'Demo_ASG_3', 'desired': 5, 'max': 5, 'new_desired': 5,
+             'reason': tool.REASON_AT_MAX}], plan)
+        self.asg_obj._asg.set_desired_capacity.assert_not_called()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'plan.json')
+            self.asg_obj.write_plan(plan, path)
+            self.assertEqual(plan, self.asg_obj.load_plan(path))
+
+    def test_apply_plan_idempotent(self):
+        """
+        Method to validate apply_plan skips entries whose ASG no longer
+        has the planned desired capacity
+        """
+        plan = [{'group': 'Demo_ASG_1', 'desired': 1, 'max': 5, 'new_desired': 2,
+                 'reason': tool.REASON_INCREASE},
+                {'group': 'Demo_ASG_2', 'desired': 1, 'max': 5, 'new_desired': 2,
+                 'reason': tool.REASON_INCREASE},
+                {'group': 'Demo_ASG_3', 'desired': 5, 'max': 5, 'new_desired': 5,
+                 'reason': tool.REASON_AT_MAX}]
+        # Demo_ASG_2 has already been increased
+        self.asg_obj._asg.describe_auto_scaling_groups.return_value = {
+            "AutoScalingGroups": [self.get_asg_record('Demo_ASG_1'),
+                                  self.get_asg_record('Demo_ASG_2', desired=2)]}
+        results = self.asg_obj.apply_plan(plan)
+        self.assertEqual({'Demo_ASG_1': True, 'Demo_ASG_2': False}, results)
+        self.asg_obj._asg.describe_auto_scaling_groups.assert_called_once_with(
+            AutoScalingGroupNames=['Demo_ASG_1', 'Demo_ASG_2'])
+        self.asg_obj._asg.set_desired_capacity.assert_called_once_with(
+            AutoScalingGroupName='Demo_ASG_1', DesiredCapacity=2, HonorCooldown=False)
+
+    def test_run_daemon(self):
+        """
+        Method to validate the daemon loop reuses the sweep until it is stopped
+        and survives a failed sweep
+        """
+        stop_event = threading.Event()
+        error = ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}},
+                            'DescribeAutoScalingGroups')
+        sweep = MagicMock(side_effect=[error, {}, {}])
+        cycles = tool.run_daemon(sweep, interval=0, jitter=0, stop_event=stop_event,
+                                 max_cycles=3)
+        self.assertEqual(3, cycles)
+        self.assertEqual(3, sweep.call_count)
+        stop_event.set()
+        self.assertEqual(0, tool.run_daemon(sweep, interval=60, stop_event=stop_event))
+
+    def test_asg_record_from_group(self):
+        """
+        Method to validate the projection keeps only capacities and tags
+        """
+        group = dict(self.get_paginator_response_success().__next__(), DesiredCapacity=2)
+        record = tool.AsgRecord.from_group(group)
+        self.assertEqual(('Demo_ASG_1', 2, 1, 5), (record.name, record.desired,
+                                                   record.min_size, record.max_size))
+        self.assertEqual('Test_value', record.tag('Test_key'))
+        self.assertIsNone(record.tag('Missing_key'))
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertIs(record, tool.AsgRecord.of(record))
+        self.assertEqual(record, tool.AsgRecord.of(group))
+
+    def test_rate_limiter_budgets(self):
+        """
+        Method to validate the ASG_RATE_LIMITS parsing and the token waits
+        """
+        self.assertEqual({'SetDesiredCapacity': (2.0, None), 'DescribePolicies': (5.0, 10.0),
+                          '*': (1.0, None)},
+                         tool.AsgRateLimiter.parse_budgets(
+                             'set_desired_capacity=2, DescribePolicies=5:10,*=1'))
+        limiter = tool.AsgRateLimiter({'SetDesiredCapacity': (1000, 1)})
+        self.assertEqual(0, limiter.acquire('DescribePolicies'))
+        self.assertEqual(0, limiter.acquire('SetDesiredCapacity'))
+        self.assertGreater(limiter.acquire('SetDesiredCapacity'), 0)
+        self.assertIn('SetDesiredCapacity', limiter.waited)
+        self.assertRaises(ValueError, tool.AsgRateLimiter.parse_budgets, 'DescribePolicies=0')
+        self.assertRaises(ValueError, tool.AsgRateLimiter.parse_budgets, '*=-1')
+        self.assertRaises(ValueError, tool.TokenBucket, 0)
+        self.assertRaises(ValueError, tool.AsgRateLimiter.parse_budgets, 'DescribePolicies=5:0.5')
+        self.assertRaises(ValueError, tool.AsgRateLimiter.parse_budgets, 'DescribePolicies=5:0')
+        self.assertRaises(ValueError, tool.TokenBucket, 5, 0)
+
+    def test_rate_limiter_attached(self):
+        """
+        Method to validate the limiter from ASG_RATE_LIMITS is hooked on every attempt
+        """
+        with patch.dict(os.environ, {"ASG_RATE_LIMITS": "DescribePolicies=5"}):
+            asg_obj = tool.AsgCount(asg_client=MagicMock(name="asg_client"))
+        self.assertIn('DescribePolicies', asg_obj.rate_limiter.buckets)
+        register = asg_obj._asg.meta.events.register
+        self.assertIn((('before-send.autoscaling', asg_obj.rate_limiter._before_send),),
+                      [call[:1] for call in register.call_args_list])
+        self.assertIsNone(tool.AsgRateLimiter.from_env())
+
+    def test_shards(self):
+        """
+        Method to validate ASG_SHARD_INDEX/ASG_SHARD_COUNT split the sweep in disjoint slices
+        """
+        names = ['Demo_ASG_{}'.format(index) for index in range(50)]
+        slices = [{name for name in names if tool.in_shard(name, index, 3)} for index in range(3)]
+        self.assertEqual(set(names), set.union(*slices))
+        self.assertEqual(len(names), sum(len(shard) for shard in slices))
+        self.assertTrue(all(slices))
+        self.assertEqual((0, 1), tool.get_shard())
+        self.assertRaises(ValueError, tool.get_shard, 3, 3)
+        with patch.dict(os.environ, {"ASG_SHARD_INDEX": "1", "ASG_SHARD_COUNT": "3"}):
+            asg_obj = tool.AsgCount(asg_client=MagicMock(name="asg_client"),
+                                    use_policy_index=False)
+        asg_obj.iter_asgs_filtered = MagicMock(
+            return_value=iter(tool.AsgRecord.of(self.get_asg_record(name)) for name in names))
+        swept = [asg.name for asg in asg_obj._iter_sweep_asgs('Test_key', 'Test_value')]
+        self.assertEqual(sorted(slices[1]), sorted(swept))
+
+    @patch.dict(os.environ, {"ASG_TAG_NAME": "Test_key", "ASG_TAG_VALUE": "Test_value"})
+    def test_journal_resume(self):
+        """
+        Method to validate a sweep interrupted by the container being killed
+        is resumed without handling or increasing any ASG twice
+        """
+        records = [self.get_asg_record('Demo_ASG_1'), self.get_asg_record('Demo_ASG_2'),
+                   self.get_asg_record('Demo_ASG_3')]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'journal.jsonl')
+            asg_obj = tool.AsgCount(asg_client=MagicMock(name="asg_client"),
+                                    use_policy_index=False, journal=tool.AsgSweepJournal(path))
+            asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+            asg_obj._asg.get_paginator.return_value.paginate.return_value. \
+                search.side_effect = lambda _expression: iter(records)
+            # killed while increasing Demo_ASG_2, after the call reached the service
+            asg_obj._asg.set_desired_capacity.side_effect = [{}, KeyboardInterrupt]
+            self.assertRaises(KeyboardInterrupt, asg_obj.run)
+            records[1] = self.get_asg_record('Demo_ASG_2', desired=2)
+            asg_obj._asg.set_desired_capacity.reset_mock(side_effect=True)
+            asg_obj.journal = tool.AsgSweepJournal(path)
+            self.assertEqual({'Demo_ASG_3': True}, asg_obj.run())
+            asg_obj._asg.set_desired_capacity.assert_called_once_with(
+                AutoScalingGroupName='Demo_ASG_3', DesiredCapacity=2, HonorCooldown=False)
+            # the finished sweep is not resumed
+            self.assertEqual(0, tool.AsgSweepJournal(path).begin())
+
+    @patch.dict(os.environ, {"ASG_TAG_NAME": "Test_key", "ASG_TAG_VALUE": "Test_value",
+                             "ASG_POLICY_INDEX": "false"})
+    def test_journal_per_target(self):
+        """
+        Method to validate the targets of a multi-target run keep journals of their own,
+        so the interrupted sweep of one region is not resumed by another region
+        """
+        records = [self.get_asg_record('Demo_ASG_{}'.format(index)) for index in range(1, 5)]
+        role_arn = 'arn:aws:iam::123456789012:role/ops/deployer'
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.dict(os.environ, {"ASG_JOURNAL_PATH": os.path.join(directory, 'j.jsonl')}), \
+                patch.object(tool, '_TARGET_ASG_COUNTS', {}), \
+                patch('boto3.session.Session', side_effect=lambda **_kwargs: MagicMock()):
+            east = tool._target_asg_count('us-east-1', None)
+            west = tool._target_asg_count('us-west-2', role_arn)
+            self.assertEqual(os.path.join(directory, 'j.us-east-1.self.jsonl'), east.journal.path)
+            self.assertEqual(os.path.join(directory, 'j.us-west-2.123456789012-deployer.jsonl'),
+                             west.journal.path)
+            for asg_obj in (east, west):
+                asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+                asg_obj._asg.get_paginator.return_value.paginate.return_value. \
+                    search.side_effect = lambda _expression: iter(records)
+            # east is killed halfway, west has groups of the same names
+            east._asg.set_desired_capacity.side_effect = [{}, {}, KeyboardInterrupt]
+            self.assertRaises(KeyboardInterrupt, east.run)
+            self.assertEqual(4, sum(outcome is True for outcome in west.run().values()))
+
+    @patch.dict(os.environ, {"ASG_TAG_NAME": "Test_key", "ASG_TAG_VALUE": "Test_value",
+                             "ASG_POLICY_INDEX": "false"})
+    def test_reports_per_target(self):
+        """
+        Method to validate the targets of a multi-target run write decision reports
+        and metrics of their own, labelled with their region and role
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            environ = {"ASG_DECISION_REPORT": os.path.join(directory, 'decisions.jsonl.gz'),
+                       "ASG_METRICS_JSON": os.path.join(directory, 'metrics.json'),
+                       "ASG_METRICS_PROM": os.path.join(directory, 'metrics.prom')}
+            with patch.dict(os.environ, environ), patch.object(tool, '_TARGET_ASG_COUNTS', {}), \
+                    patch('boto3.session.Session', side_effect=lambda **_kwargs: MagicMock()):
+                for region in ('us-east-1', 'us-west-2'):
+                    asg_obj = tool._target_asg_count(region, None)
+                    asg_obj._asg.get_paginator.return_value.paginate.return_value. \
+                        search.side_effect = lambda _expression: iter(
+                            [self.get_asg_record('Demo_ASG_1', desired=5)])
+                    asg_obj.run()
+            for region in ('us-east-1', 'us-west-2'):
+                name = 'decisions.{}.self.jsonl.gz'.format(region)
+                with gzip.open(os.path.join(directory, name), 'rt', encoding='utf-8') as report:
+                    lines = [json.loads(line) for line in report]
+                self.assertEqual([(region, None)], [(line['region'], line['role_arn'])
+                                                    for line in lines])
+                name = 'metrics.{}.self.json'.format(region)
+                with open(os.path.join(directory, name), encoding='utf-8') as json_file:
+                    self.assertEqual(region, json.load(json_file)['region'])
+                name = 'metrics.{}.self.prom'.format(region)
+                with open(os.path.join(directory, name), encoding='utf-8') as prom_file:
+                    self.assertIn('asg_sweep_groups{{outcome="untouched",region="{}",'
+                                  'role_arn=""}} 1'.format(region), prom_file.read())
+
+    def test_tag_selector(self):
+        """
+        Method to validate the selector language, its predicate and the tag index agree
+        """
+        def record(name, **tags):
+            return tool.AsgRecord(name, 1, 1, 5, tuple(tags.items()))
+        records = [record('web', team='payments', env='prod'),
+                   record('batch', team='payments', env='staging-2', spot='yes'),
+                   record('ml', team='research', env='staging-1'),
+                   record('legacy', env='prod')]
+        index = tool.TagIndex(records)
+        expected = {
+            'team=payments & env=prod': ['web'],
+            'team=payments and (env=prod or env^=staging)': ['batch', 'web'],
+            'env^=staging & !spot': ['ml'],
+            'not team': ['legacy'],
+            '"team" = \'research\' | spot': ['batch', 'ml'],
+        }
+        for text, names in expected.items():
+            selector = tool.compile_selector(text)
+            self.assertEqual(names, [asg.name for asg in index.select(selector)], text)
+            self.assertEqual(names, sorted(asg.name for asg in records if selector.matches(asg)))
+        self.assertIs(tool.compile_selector('not team'), tool.compile_selector('not team'))
+        self.assertEqual(('team', 'payments'),
+                         tool.compile_selector('team=payments & !spot').required_tag())
+        self.assertIsNone(tool.compile_selector('team=payments | spot').required_tag())
+        for invalid in ('team=', '(team=payments', 'team=payments &', 'env!=prod'):
+            self.assertRaises(ValueError, tool.TagSelector, invalid)
+        # changing a selection leaves the index untouched
+        tool.compile_selector('env=prod').select(index).clear()
+        self.assertEqual(['legacy', 'web'],
+                         [asg.name for asg in index.select(tool.compile_selector('env=prod'))])
+
+    def test_select_asgs_single_pagination(self):
+        """
+        Method to validate many selectors cost one inventory pagination
+        """
+        self.asg_obj._asg.get_paginator.return_value.paginate.return_value. \
+            search.return_value = iter([self.get_asg_record('Demo_ASG_1'),
+                                        dict(self.get_asg_record('Demo_ASG_2'), Tags=[])])
+        selected = self.asg_obj.select_asgs(['Test_key=Test_value', '!Test_key', 'Test_key^=T'])
+        self.asg_obj._asg.get_paginator.return_value.paginate.assert_called_once_with(
+            PaginationConfig={'MaxItems': 100000, 'PageSize': 100}, IncludeInstances=False)
+        self.assertEqual({'Test_key=Test_value': ['Demo_ASG_1'], '!Test_key': ['Demo_ASG_2'],
+                          'Test_key^=T': ['Demo_ASG_1']},
+                         {text: [asg.name for asg in asgs] for text, asgs in selected.items()})
+
+    def test_sweep_with_selector(self):
+        """
+        Method to validate ASG_SELECTOR drives the sweep, filtered server side on its
+        required tag
+        """
+        with patch.dict(os.environ, {"ASG_SELECTOR": "Test_key=Test_value & !Skip"}):
+            asg_obj = tool.AsgCount(asg_client=MagicMock(name="asg_client"),
+                                    use_policy_index=False)
+        asg_obj._asg.get_paginator.return_value.paginate.return_value. \
+            search.return_value = iter([
+                self.get_asg_record('Demo_ASG_1'),
+                dict(self.get_asg_record('Demo_ASG_2'),
+                     Tags=[{"Key": "Test_key", "Value": "Test_value"}, {"Key": "Skip"}])])
+        asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+        self.assertEqual({'Demo_ASG_1': True}, asg_obj.run())
+        self.assertEqual([{'Name': 'tag:Test_key', 'Values': ['Test_value']}],
+                         asg_obj._asg.get_paginator.return_value.paginate.call_args[1]['Filters'])
+
+    def test_event_sources(self):
+        """
+        Method to validate the file and directory event sources and the event parsing
+        """
+        api_call = {'detail-type': 'AWS API Call via CloudTrail',
+                    'detail': {'eventName': 'PutScalingPolicy',
+                               'requestParameters': {'autoScalingGroupName': 'Demo_ASG_1'}}}
+        tagging = {'detail': {'eventName': 'CreateOrUpdateTags', 'requestParameters': {
+            'tags': [{'resourceId': 'Demo_ASG_2', 'resourceType': 'auto-scaling-group'}]}}}
+        launch = {'detail-type': 'EC2 Instance Launch Successful',
+                  'detail': {'AutoScalingGroupName': 'Demo_ASG_3'}}
+        self.assertEqual(({'Demo_ASG_1'}, True), tool.event_groups(api_call))
+        self.assertEqual(({'Demo_ASG_2'}, False), tool.event_groups(tagging))
+        self.assertEqual(({'Demo_ASG_3'}, False), tool.event_groups(launch))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'events.jsonl')
+            with open(path, 'w', encoding='utf-8') as events_file:
+                events_file.write(json.dumps(api_call) + '\n' + json.dumps(launch)[:10])
+            source = tool.event_source(path)
+            self.assertEqual([api_call], source.poll())
+            with open(path, 'a', encoding='utf-8') as events_file:
+                events_file.write(json.dumps(launch)[10:] + '\n')
+            self.assertEqual([launch], source.poll())
+            self.assertEqual([], source.poll())
+            queue = os.path.join(directory, 'queue')
+            os.mkdir(queue)
+            for name, content in (('1.json', json.dumps([api_call, tagging])),
+                                  ('2.json', json.dumps(launch)), ('3.json', '{')):
+                with open(os.path.join(queue, name), 'w', encoding='utf-8') as event_file:
+                    event_file.write(content)
+            source = tool.event_source(queue)
+            self.assertEqual([api_call, tagging, launch], source.poll())
+            self.assertEqual(['3.json.invalid'], os.listdir(queue))
+
+    @patch.dict(os.environ, {"ASG_TAG_NAME": "Test_key", "ASG_TAG_VALUE": "Test_value"})
+    def test_incremental_sweep(self):
+        """
+        Method to validate the event driven cycles only process the changed ASG
+        and ignore the change events of their own increases
+        """
+        groups = {name: self.get_asg_record(name) for name in ('Demo_ASG_1', 'Demo_ASG_2')}
+        self.asg_obj.use_policy_index = False
+        self.asg_obj._asg.get_paginator.return_value.paginate.return_value. \
+            search.return_value = iter(list(groups.values()))
+        self.asg_obj._asg.describe_auto_scaling_groups.side_effect = \
+            lambda AutoScalingGroupNames: {"AutoScalingGroups": [
+                groups[name] for name in AutoScalingGroupNames if name in groups]}
+        self.asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+        source = MagicMock(name="source")
+        source.poll.return_value = []
+        incremental = tool.AsgIncrementalSweep(self.asg_obj, source)
+        self.assertEqual({'Demo_ASG_1': True, 'Demo_ASG_2': True}, incremental.cycle())
+        # Demo_ASG_1 echoes our own increase, Demo_ASG_2 was resized, Demo_ASG_3 is gone
+        groups['Demo_ASG_1'] = self.get_asg_record('Demo_ASG_1', desired=2)
+        groups['Demo_ASG_2'] = self.get_asg_record('Demo_ASG_2', desired=2, max_cap=3)
+        source.poll.return_value = [
+            {'detail': {'AutoScalingGroupName': name}}
+            for name in ('Demo_ASG_1', 'Demo_ASG_2', 'Demo_ASG_3')]
+        self.asg_obj._asg.set_desired_capacity.reset_mock()
+        self.assertEqual({'Demo_ASG_2': True}, incremental.cycle())
+        self.asg_obj._asg.set_desired_capacity.assert_called_once_with(
+            AutoScalingGroupName='Demo_ASG_2', DesiredCapacity=3, HonorCooldown=False)
+        self.assertEqual(3, incremental.records['Demo_ASG_2'].desired)
+        self.assertNotIn('Demo_ASG_3', incremental.records)
+        source.poll.return_value = []
+        self.assertEqual({}, incremental.cycle())
+
+    def test_scheduler_priority(self):
+        """
+        Method to validate the ASG are ordered by tag priority, headroom and last increase
+        """
+        def record(name, desired, max_cap, priority=None):
+            tags = (('asg-priority', priority),) if priority is not None else ()
+            return tool.AsgRecord(name, desired, 1, max_cap, tags)
+        scheduler = tool.AsgScheduler(self.asg_obj, budget=60, margin=0)
+        scheduler.last_bumped = {'Demo_ASG_3': 100.0}
+        asgs = [record('Demo_ASG_1', 1, 2), record('Demo_ASG_2', 1, 9),
+                record('Demo_ASG_3', 1, 5), record('Demo_ASG_4', 1, 5),
+                record('Demo_ASG_5', 4, 5, priority='10'), record('Demo_ASG_6', 1, 5, 'high')]
+        self.assertEqual(['Demo_ASG_5', 'Demo_ASG_2', 'Demo_ASG_4', 'Demo_ASG_6', 'Demo_ASG_3',
+                          'Demo_ASG_1'], [asg.name for asg in scheduler.schedule(asgs)])
+        self.assertEqual([], scheduler.skipped)
+        self.assertRaises(ValueError, tool.AsgScheduler, self.asg_obj, 60, ['size'])
+
+    @patch.dict(os.environ, {"ASG_TAG_NAME": "Test_key", "ASG_TAG_VALUE": "Test_value",
+                             "ASG_TIME_BUDGET": "0.3", "ASG_SCHEDULE_MARGIN": "0.05"})
+    def test_scheduler_deadline(self):
+        """
+        Method to validate a budgeted run stops before its deadline, highest headroom first,
+        and reports the skipped ASG
+        """
+        asg_obj = tool.AsgCount(asg_client=MagicMock(name="asg_client"), use_policy_index=False)
+        asg_obj._asg.get_paginator.return_value.paginate.return_value. \
+            search.return_value = iter([self.get_asg_record('Demo_ASG_{}'.format(index),
+                                                            max_cap=index + 2)
+                                        for index in range(20)])
+        asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+        asg_obj._asg.set_desired_capacity.side_effect = lambda **_kwargs: time.sleep(0.05)
+        start = time.monotonic()
+        results = asg_obj.run()
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertTrue(results and asg_obj.scheduler.skipped)
+        self.assertEqual(20, len(results) + len(asg_obj.scheduler.skipped))
+        self.assertIn('Demo_ASG_19', results)
+        self.assertIn('Demo_ASG_0', asg_obj.scheduler.skipped)
+        self.assertGreater(asg_obj.scheduler.report()['estimate_seconds'], 0.04)
+        self.assertEqual(len(asg_obj.scheduler.skipped), asg_obj.metrics.outcomes['skipped'])
+
+    @patch.dict(os.environ, {"ASG_TAG_NAME": "Test_key", "ASG_TAG_VALUE": "Test_value"})
+    def test_decision_report(self):
+        """
+        Method to validate one gzip JSON line per processed ASG, errors included,
+        appended sweep after sweep
+        """
+        self.asg_obj.use_policy_index = False
+        self.asg_obj._asg.get_paginator.return_value.paginate.return_value. \
+            search.side_effect = lambda _expression: iter([
+                self.get_asg_record('Demo_ASG_1'), self.get_asg_record('Demo_ASG_2', 5, 5),
+                self.get_asg_record('Demo_ASG_3'), self.get_asg_record('Demo_ASG_4')])
+        error = ClientError({'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded'}},
+                            'DescribePolicies')
+
+        def describe_policies(AutoScalingGroupName):
+            if AutoScalingGroupName == 'Demo_ASG_4':
+                raise error
+            return {"ScalingPolicies": [{}] if AutoScalingGroupName == 'Demo_ASG_1' else []}
+        self.asg_obj._asg.describe_policies.side_effect = describe_policies
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'decisions.jsonl.gz')
+            self.asg_obj.decision_report = tool.AsgDecisionReport(path)
+            self.asg_obj.run()
+            self.asg_obj.run()
+            with gzip.open(path, 'rt', encoding='utf-8') as report:
+                lines = [json.loads(line) for line in report]
+        self.assertEqual(8, len(lines))
+        self.assertEqual(2, len({line['sweep'] for line in lines}))
+        decisions = {line['group']: line for line in lines[:4]}
+        self.assertEqual(('increase', True, 2, None),
+                         tuple(decisions['Demo_ASG_1'][key]
+                               for key in ('action', 'policy', 'new_desired', 'error')))
+        self.assertEqual(('at_max', None, 5), tuple(
+            decisions['Demo_ASG_2'][key] for key in ('action', 'policy', 'new_desired')))
+        self.assertEqual(('no_scaling_policy', False), tuple(
+            decisions['Demo_ASG_3'][key] for key in ('action', 'policy')))
+        self.assertEqual('error', decisions['Demo_ASG_4']['action'])
+        self.assertIn('Throttling', decisions['Demo_ASG_4']['error'])
+        self.assertEqual({'group', 'desired', 'max', 'policy', 'action', 'new_desired',
+                          'latency', 'error', 'sweep'}, set(decisions['Demo_ASG_4']))
+
+    @patch.dict(os.environ, {"ASG_TAG_NAME": "Test_key", "ASG_TAG_VALUE": "Test_value"})
+    def test_incremental_resync_with_journal(self):
+        """
+        Method to validate full resyncs and event cycles go through run() bookkeeping:
+        the journal is finished so a resync sweeps every ASG again, and metrics are exported
+        """
+        groups = {name: self.get_asg_record(name) for name in ('Demo_ASG_1', 'Demo_ASG_2')}
+        source = MagicMock(name="source")
+        with tempfile.TemporaryDirectory() as directory:
+            asg_obj = tool.AsgCount(
+                asg_client=MagicMock(name="asg_client"), use_policy_index=False,
+                journal=tool.AsgSweepJournal(os.path.join(directory, 'journal.jsonl')),
+                metrics=tool.AsgMetrics(json_path=os.path.join(directory, 'metrics.json')))
+            asg_obj._asg.get_paginator.return_value.paginate.return_value. \
+                search.side_effect = lambda _expression: iter(list(groups.values()))
+            asg_obj._asg.describe_auto_scaling_groups.side_effect = \
+                lambda AutoScalingGroupNames: {"AutoScalingGroups": [
+                    groups[name] for name in AutoScalingGroupNames]}
+            asg_obj._asg.describe_policies.return_value = {"ScalingPolicies": [{}]}
+            incremental = tool.AsgIncrementalSweep(asg_obj, source, resync=0)
+            source.poll.return_value = []
+            for _cycle in range(2):
+                self.assertEqual({'Demo_ASG_1': True, 'Demo_ASG_2': True}, incremental.cycle())
+                self.assertEqual(2, len(incremental.records))
+            # an event cycle in between does not leave the journal open either
+            incremental.resync = 3600
+            groups['Demo_ASG_1'] = self.get_asg_record('Demo_ASG_1', max_cap=3)
+            source.poll.return_value = [{'detail': {'AutoScalingGroupName': 'Demo_ASG_1'}}]
+            self.assertEqual({'Demo_ASG_1': True}, incremental.cycle())
+            incremental.resync = 0
+            source.poll.return_value = []
+            self.assertEqual(2, len(incremental.cycle()))
+            with open(os.path.join(directory, 'metrics.json'), encoding='utf-8') as summary:
+                # the outcomes of the last sweep, not of the 4 sweeps
+                self.assertEqual({'increased': 2}, json.load(summary)['outcomes'])
+
+    @patch.dict(os.environ, {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "test",
+                             "AWS_SECRET_ACCESS_KEY": "test"})
+    def test_default_client_per_instance(self):
+        """
+        Method to validate every AsgCount gets its own default client, so the metrics
+        of one instance never count the calls of another
+        """
+        from botocore.stub import Stubber
+        with patch.object(tool, '_DEFAULT_SESSION', None), \
+                patch.object(tool, '_DEFAULT_CLIENTS', {}):
+            counts = [tool.AsgCount() for _ in range(3)]
+            self.assertEqual(3, len({id(asg_count._asg) for asg_count in counts}))
+            counts[0].metrics.attach(counts[0]._asg)
+            with Stubber(counts[0]._asg) as stubber:
+                stubber.add_response('describe_policies', {'ScalingPolicies': []})
+                counts[0]._asg.describe_policies()
+            self.assertEqual(1, counts[0].metrics.operations['DescribePolicies']['calls'])
+            for asg_count in counts[1:]:
+                self.assertNotIn('DescribePolicies', asg_count.metrics.operations)
+            # the async default path gets its own client too, its metrics are attached
+            async_count = tool.AsyncAsgCount()
+            self.assertIsNot(tool._default_client(10), async_count._asg._client)
+            self.assertIs(async_count._asg, async_count.asg_count._asg)
+
 
 if __name__ == "__main__":
     unittest.main()
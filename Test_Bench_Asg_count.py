@@ -0,0 +1,231 @@
+"""
+    Unit test cases for the benchmark harness and its fake autoscaling client
+"""
+import gzip
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+import Asg_count
+import Bench_Asg_count as bench
+
+
+class TestFakeAutoScalingClient(unittest.TestCase):
+    """
+        Test Class for FakeAutoScalingClient
+    """
+
+    def setUp(self) -> None:
+        """
+        overriding setUp method to create a fake client over a small fleet
+        """
+        super().setUp()
+        groups, policies = bench.make_fleet(120, match_ratio=0.5)
+        self.client = bench.FakeAutoScalingClient(groups, policies)
+
+    def test_pagination_tokens(self):
+        """
+        Method to validate every group is served once across the NextToken pages
+        """
+        pages = list(self.client.get_paginator('describe_auto_scaling_groups').
+                     paginate(PaginationConfig={'PageSize': 50}))
+        self.assertEqual(3, len(pages))
+        self.assertNotIn('NextToken', pages[-1])
+        names = [group['AutoScalingGroupName'] for page in pages
+                 for group in page['AutoScalingGroups']]
+        self.assertEqual(120, len(set(names)))
+        self.assertEqual(3, self.client.calls['DescribeAutoScalingGroups'])
+
+    def test_tag_filter(self):
+        """
+        Method to validate the tag:<key> filter only returns tagged groups
+        """
+        filtered = list(self.client.get_paginator('describe_auto_scaling_groups').paginate(
+            Filters=[{'Name': 'tag:{}'.format(bench.BENCH_TAG_KEY),
+                      'Values': [bench.BENCH_TAG_VALUE]}]).search('AutoScalingGroups[]'))
+        self.assertTrue(filtered)
+        for group in filtered:
+            self.assertIn(bench.BENCH_TAG_KEY, [tag['Key'] for tag in group['Tags']])
+
+    def test_throttling_exhausted(self):
+        """
+        Method to validate a call throttled max_attempts times raises Throttling
+        """
+        self.client.throttle_rate = 1.0
+        self.client.max_attempts = 3
+        with self.assertRaises(ClientError) as context:
+            self.client.describe_policies()
+        self.assertEqual('Throttling', context.exception.response['Error']['Code'])
+        self.assertEqual(3, self.client.throttles['DescribePolicies'])
+
+    def test_rate_limiter_per_attempt(self):
+        """
+        Method to validate every retried attempt waits for a token of the rate limiter
+        """
+        self.client.throttle_rate = 1.0
+        self.client.max_attempts = 3
+        limiter = Asg_count.AsgRateLimiter({'*': (1000, 100)})
+        limiter.attach(self.client)
+        with patch.object(limiter, 'acquire', wraps=limiter.acquire) as acquire:
+            self.assertRaises(ClientError, self.client.describe_policies)
+        self.assertEqual(3, acquire.call_count)
+        acquire.assert_called_with('DescribePolicies')
+
+
+class TestRunBenchmark(unittest.TestCase):
+    """
+        Test Class for run_benchmark
+    """
+
+    def test_sweep_modes_agree(self):
+        """
+        Method to validate every mode takes the same decisions
+        and the sweep avoids the per ASG describe calls
+        """
+        reports = {mode: bench.run_benchmark(mode, 500, match_ratio=0.2)
+                   for mode in ('legacy', 'sweep', 'threaded', 'async')}
+        increased = {report['increased'] for report in reports.values()}
+        self.assertEqual(1, len(increased))
+        self.assertGreater(reports['legacy']['calls']['DescribeAutoScalingGroups'],
+                           reports['sweep']['calls']['DescribeAutoScalingGroups'])
+        # tracemalloc stays off while timing
+        self.assertIsNone(reports['sweep']['peak_memory_bytes'])
+        traced = bench.run_benchmark('sweep', 500, match_ratio=0.2, trace_memory=True)
+        self.assertGreater(traced['peak_memory_bytes'], 0)
+        self.assertEqual(reports['sweep']['increased'], traced['increased'])
+
+
+class TestBenchMetrics(unittest.TestCase):
+    """
+        Test Class for the metrics collected through the fake client events
+    """
+
+    def test_metrics_through_events(self):
+        """
+        Method to validate the AsgMetrics hooks see the fake client calls and retries
+        """
+        report = bench.run_benchmark('sweep', 300, throttle_rate=0.1, match_ratio=0.5)
+        operations = report['metrics']['operations']
+        for operation, calls in report['calls'].items():
+            self.assertEqual(calls, operations[operation]['calls'])
+            self.assertEqual(report['throttles'].get(operation, 0),
+                             operations[operation]['throttles'])
+        self.assertGreater(operations['DescribeAutoScalingGroups']['bytes'], 0)
+        self.assertIn('pagination', report['metrics']['phases'])
+
+
+class TestStartupBudget(unittest.TestCase):
+    """
+        Test Class for the import and startup time budget
+    """
+
+    def test_startup_budget(self):
+        """
+        Method to validate the injected client path loads neither boto3 nor asyncio
+        and the default client is reused once created
+        """
+        report = bench.measure_startup(runs=1)
+        self.assertEqual([], report['heavy_modules'])
+        self.assertLess(report['reused_startup_ms'], report['default_startup_ms'])
+        self.assertEqual([], bench.check_startup_budget(report, import_budget_ms=1000,
+                                                        injected_budget_ms=1000))
+        self.assertEqual(2, len(bench.check_startup_budget(
+            dict(report, import_ms=200, heavy_modules=['boto3']), import_budget_ms=100,
+            injected_budget_ms=1000)))
+
+
+class TestShardedBenchmark(unittest.TestCase):
+    """
+        Test Class for the sharded benchmark mode
+    """
+
+    def test_shards_are_disjoint(self):
+        """
+        Method to validate the shards cover the fleet once and increase every ASG once
+        """
+        sweep = bench.run_benchmark('sweep', 400, match_ratio=0.5)
+        sharded = bench.run_benchmark('sharded', 400, match_ratio=0.5, shards=3)
+        self.assertEqual(0, sharded['duplicates'])
+        self.assertEqual(3, len(sharded['shard_seconds']))
+        self.assertEqual((sweep['matched'], sweep['increased']),
+                         (sharded['matched'], sharded['increased']))
+        self.assertEqual(sweep['increased'], sharded['calls']['SetDesiredCapacity'])
+
+
+class TestIncrementalBenchmark(unittest.TestCase):
+    """
+        Test Class for the incremental benchmark mode
+    """
+
+    def test_cycle_cost_follows_churn(self):
+        """
+        Method to validate an event driven cycle only describes and processes the churn
+        """
+        report = bench.run_benchmark('incremental', 1000, match_ratio=0.5, churn=0.02)
+        self.assertGreater(report['matched'], 0)
+        self.assertLessEqual(report['matched'], 20)
+        self.assertEqual(1, report['cycle_calls']['DescribeAutoScalingGroups'])
+        self.assertNotIn('DescribePolicies', report['cycle_calls'])
+        self.assertEqual(report['increased'], report['cycle_calls'].get('SetDesiredCapacity', 0))
+
+
+class TestCassette(unittest.TestCase):
+    """
+        Test Class for RecordingClient and ReplayClient
+    """
+
+    def test_record_and_replay(self):
+        """
+        Method to validate a recorded dry run replays a full sweep with the same
+        pages and decisions, with the ARNs redacted
+        """
+        groups, policies = bench.make_fleet(300, match_ratio=0.5)
+        client = bench.FakeAutoScalingClient(groups, policies)
+        expected = bench.run_benchmark('sweep', 300, match_ratio=0.5)
+        environ = {'ASG_TAG_NAME': bench.BENCH_TAG_KEY, 'ASG_TAG_VALUE': bench.BENCH_TAG_VALUE}
+        with tempfile.TemporaryDirectory() as directory, \
+                patch.dict(os.environ, environ):
+            path = os.path.join(directory, 'cassette.jsonl.gz')
+            with bench.RecordingClient(client, path) as recorder:
+                bench.AsgCount(asg_client=recorder).plan_sweep()
+            self.assertEqual(sum(client.calls.values()), recorder.recorded)
+            with gzip.open(path, 'rt', encoding='utf-8') as cassette:
+                recorded = cassette.read()
+            self.assertNotIn('arn:aws:autoscaling', recorded)
+            self.assertIn('redacted-', recorded)
+            replayed = bench.run_benchmark('threaded', None, cassette=path, latency_scale=0)
+            # the per ASG describe calls of the legacy mode are not in the cassette
+            self.assertRaises(ValueError, bench.run_benchmark, 'legacy', None, cassette=path)
+            with patch('sys.argv', ['Bench_Asg_count.py', '--replay', path,
+                                    '--modes', 'sweep', 'legacy']), \
+                    patch('sys.stderr'), self.assertRaises(SystemExit):
+                bench._main()
+        self.assertEqual((expected['matched'], expected['increased']),
+                         (replayed['matched'], replayed['increased']))
+        self.assertEqual(expected['calls'], replayed['calls'])
+
+    def test_replay_errors_and_misses(self):
+        """
+        Method to validate recorded errors are raised again and unknown calls are reported
+        """
+        client = bench.FakeAutoScalingClient(*bench.make_fleet(10), throttle_rate=1.0,
+                                             max_attempts=1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cassette.jsonl.gz')
+            with bench.RecordingClient(client, path) as recorder:
+                self.assertRaises(ClientError, recorder.describe_policies,
+                                  AutoScalingGroupName='bench-asg-000001')
+            replay = bench.ReplayClient(path, latency_scale=0)
+        with self.assertRaises(ClientError) as raised:
+            replay.describe_policies(AutoScalingGroupName='bench-asg-000001')
+        self.assertEqual('Throttling', raised.exception.response['Error']['Code'])
+        self.assertRaises(KeyError, replay.describe_policies,
+                          AutoScalingGroupName='bench-asg-000002')
+        self.assertEqual({}, {key: value for key, value in replay.set_desired_capacity(
+            AutoScalingGroupName='bench-asg-000001', DesiredCapacity=2).items()
+                              if key != 'ResponseMetadata'})
+
+
+if __name__ == "__main__":
+    unittest.main()